@@ -136,14 +136,39 @@ Removing Documents
 >>> document_copy.remove(force=True)
 >>> record_copy['files'][0]['uri']
 >>> assert not os.path.exists('/tmp/hello_move.txt')
+
+Batching Changes
+~~~~~~~~~~~~~~~~
+
+Changing many documents of one record can be collected in a batch which
+applies a single merged JSON patch and commits the record and the
+database session only once.  Files transferred by the batch are removed
+again if anything fails, and replaced files are restored.
+
+>>> from invenio_documents import batch
+>>> with batch(record) as b:
+...     b.copy(uri_pointer, '/tmp/hello_batch.txt')
+>>> b.record['files'][0]['uri']
+'/tmp/hello_batch.txt'
+>>> os.remove('/tmp/hello_batch.txt')
 >>> os.remove('/tmp/hello.txt')
 
 """
 
 from __future__ import absolute_import, print_function
 
-from .api import Document
+from .api import Document, DocumentBatch, DocumentRef, batch, \
+    iter_document_refs, stat_documents
 from .ext import InvenioDocuments
 from .version import __version__
 
-__all__ = ('__version__', 'Document', 'InvenioDocuments')
+__all__ = (
+    '__version__',
+    'batch',
+    'Document',
+    'DocumentBatch',
+    'DocumentRef',
+    'InvenioDocuments',
+    'iter_document_refs',
+    'stat_documents',
+)
@@ -26,12 +26,254 @@
 
 from __future__ import absolute_import, print_function
 
-from collections import namedtuple
+import io
+import os
+import shutil
+import uuid
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from io import BytesIO
+from tempfile import TemporaryFile
 
 import jsonpointer
 import six
+from flask import current_app, has_app_context
+from fs.errors import DestinationExistsError, NoSysPathError
 from fs.opener import opener
+from fs.path import dirname
 from fs.utils import copyfile, movefile
+from invenio_db import db
+from invenio_records.api import Record
+
+from . import locks, policy, replication, throttle
+from .delta import update
+from .drivers import get_driver
+from .errors import ContentTooLargeError, ReplicationError
+from .ingest import ChunkReader
+from .models import DocumentStat, DocumentURI
+from .profiling import phase
+from .signals import document_after_content_set, \
+    document_before_content_set, document_uri_changed
+from .storage import parse_uri
+from .utils import as_replicas, is_document_pointer, is_store_object, \
+    iter_records, iter_uris
+
+
+def _stream(src_fs, src, dst_fs, dst, wrap, overwrite=True,
+            chunk_size=64 * 1024):
+    """Copy file contents in chunks read through ``wrap``."""
+    if not overwrite and dst_fs.exists(dst):
+        raise DestinationExistsError(dst)
+    with src_fs.open(src, 'rb') as src_file:
+        dst_fs.setcontents(dst, wrap(src_file), chunk_size=chunk_size)
+
+
+def _is_rename(src_fs, src, dst_fs, dst):
+    """Check if a move is a rename on a single local device."""
+    try:
+        src_path = src_fs.getsyspath(src)
+        dst_path = dst_fs.getsyspath(dirname(dst))
+    except NoSysPathError:
+        return False
+    return os.stat(src_path).st_dev == os.stat(dst_path).st_dev
+
+
+def _watched(wrap, watchdog):
+    """Combine throttling ``wrap`` with progress tracking of a transfer."""
+    if watchdog is None:
+        return wrap
+    if wrap is None:
+        return watchdog.wrap
+    return lambda fileobj: watchdog.wrap(wrap(fileobj))
+
+
+def _copy(src, dst, **kwargs):
+    """Copy file between two URIs.
+
+    Files are copied inside the storage when the driver of both URIs
+    supports it.  Keyword arguments such as ``overwrite`` are passed to
+    the driver or to :func:`fs.utils.copyfile`.
+    """
+    driver = get_driver(src)
+    if driver.supports_server_copy and driver is get_driver(dst):
+        with locks.locked(read=(src, ), write=(dst, )), \
+                throttle.transfer(src, dst), phase('transfer'):
+            policy.call((src, dst), lambda: driver.server_copy(
+                src, dst, **kwargs
+            ), idempotent=True)
+        _forget(dst)
+        return
+
+    _fs, filename = parse_uri(src)
+    _fs_dst, filename_dst = parse_uri(dst)
+    watchdog = policy.get_watchdog((src, dst))
+    with locks.locked(read=(src, ), write=(dst, )), \
+            throttle.transfer(src, dst) as wrap:
+        wrap = _watched(wrap, watchdog)
+
+        def copy():
+            if wrap is None:
+                copyfile(_fs, filename, _fs_dst, filename_dst, **kwargs)
+            else:
+                _stream(_fs, filename, _fs_dst, filename_dst, wrap,
+                        **kwargs)
+
+        with phase('transfer'):
+            policy.call((src, dst), copy, idempotent=True,
+                        watchdog=watchdog)
+    _forget(dst)
+
+
+def _move(src, dst, **kwargs):
+    """Move file between two URIs."""
+    _fs, filename = parse_uri(src)
+    _fs_dst, filename_dst = parse_uri(dst)
+    watchdog = policy.get_watchdog((src, dst))
+    with locks.locked(write=(src, dst)), \
+            throttle.transfer(src, dst) as wrap:
+        wrap = _watched(wrap, watchdog)
+
+        def move():
+            if wrap is None or \
+                    _is_rename(_fs, filename, _fs_dst, filename_dst):
+                movefile(_fs, filename, _fs_dst, filename_dst, **kwargs)
+            else:
+                _stream(_fs, filename, _fs_dst, filename_dst, wrap,
+                        **kwargs)
+                _fs.remove(filename)
+
+        with phase('transfer'):
+            policy.call((src, dst), move, watchdog=watchdog)
+    _invalidate_cached(src, dst)
+    if _stat_cache():
+        DocumentStat.rename(src, dst)
+
+
+def _content_cache():
+    """Return the content cache of the current application if enabled."""
+    if not has_app_context():
+        return None
+    ext = current_app.extensions.get('invenio-documents')
+    return getattr(ext, 'content_cache', None)
+
+
+def _invalidate_cached(*uris):
+    """Drop cached content of files which were written or removed."""
+    cache = _content_cache()
+    if cache is not None:
+        for uri in uris:
+            cache.invalidate(uri)
+
+
+def _forget(*uris):
+    """Drop cached content and metadata of written or removed files."""
+    _invalidate_cached(*uris)
+    if _stat_cache():
+        DocumentStat.delete(uris)
+
+
+def _open_cached(uri):
+    """Open small file from the in-memory content cache if enabled."""
+    cache = _content_cache()
+    if cache is None:
+        return None
+
+    data = cache.get(uri)
+    if data is None:
+        token = cache.reserve(uri)
+        try:
+            _fs, filename = parse_uri(uri)
+            if _fs.getsize(filename) > cache.max_item_size:
+                return None
+            data = _fs.getcontents(filename, 'rb')
+            cache.set(uri, data, token=token)
+        finally:
+            cache.release(uri, token)
+    return BytesIO(data)
+
+
+def _tell(source):
+    """Return position of a seekable ``source`` or ``None``.
+
+    Python 2 files have no ``seekable`` method but support ``tell``.
+    """
+    seekable = getattr(source, 'seekable', None)
+    if seekable is not None:
+        return source.tell() if seekable() else None
+    try:
+        return source.tell()
+    except (AttributeError, IOError, ValueError):
+        return None
+
+
+def _setcontents(uri, source, delta=False, **kwargs):
+    """Write content of ``source`` to a single URI.
+
+    In delta mode only changed blocks of an existing file are rewritten
+    and the number of bytes written is returned.
+    """
+    _fs, filename = parse_uri(uri)
+    watchdog = policy.get_watchdog((uri, ))
+    if watchdog is not None and not hasattr(source, 'readinto'):
+        source = BytesIO(source.read())
+    with locks.locked(write=(uri, )), throttle.transfer(uri) as wrap:
+        wrap = _watched(wrap, watchdog)
+        position = None
+        if hasattr(source, 'readinto'):
+            data = source if wrap is None else wrap(source)
+            position = _tell(source)
+        else:
+            data = (source if wrap is None else wrap(source)).read()
+
+        def write():
+            if position is not None:
+                source.seek(position)
+            if delta:
+                return update(_fs, filename, data if hasattr(data, 'read')
+                              else BytesIO(data), **kwargs)
+            _fs.setcontents(filename, data, **kwargs)
+
+        with phase('transfer'):
+            result = policy.call((uri, ), write, idempotent=(
+                position is not None or not hasattr(source, 'readinto')
+            ), watchdog=watchdog)
+    _fs.close()
+    _forget(uri)
+    return result
+
+
+def _exists(uri):
+    """Check if the file of ``uri`` exists."""
+    _fs, filename = parse_uri(uri)
+    return policy.call((uri, ), lambda: _fs.exists(filename),
+                       idempotent=True, read_only=True)
+
+
+def _temporary_uri(uri, purpose):
+    """Return unique URI next to ``uri`` for content being written."""
+    return '{0}.{1}-{2}'.format(uri, purpose, uuid.uuid4().hex)
+
+
+def _check_movable(uris):
+    """Refuse to move objects shared through the versions store."""
+    for uri in uris:
+        if is_store_object(uri):
+            raise ValueError(
+                'Version object {0} can not be moved.'.format(uri)
+            )
+
+
+def _stat_cache():
+    """Check if metadata of written files should be cached."""
+    return has_app_context() and current_app.config['DOCUMENTS_STAT_CACHE']
+
+
+def _remove(uri):
+    """Remove file from its filesystem."""
+    _fs, filename = parse_uri(uri)
+    with locks.locked(write=(uri, )):
+        policy.call((uri, ), lambda: _fs.remove(filename))
+    _forget(uri)
 
 
 class Document(namedtuple('Document', ('record', 'pointer'))):
@@ -42,63 +284,603 @@ class Document(namedtuple('Document', ('record', 'pointer'))):
     @property
     def uri(self):
         """Read uri from given record."""
-        return jsonpointer.resolve_pointer(self.record, self.pointer)
+        with phase('pointer resolution'):
+            return jsonpointer.resolve_pointer(self.record, self.pointer)
 
     @uri.setter
     def uri(self, value):
         """Set new uri value in record.
 
-        It will not change the location of the underlying file!
+        It will not change the location of the underlying file!  A list
+        of URIs makes the document replicated.
         """
+        old_uri = jsonpointer.resolve_pointer(
+            self.record, self.pointer, None
+        )
         jsonpointer.set_pointer(self.record, self.pointer, value)
+        document_uri_changed.send(self, old_uri=old_uri, new_uri=value)
+
+    @property
+    def replicas(self):
+        """List of URIs of all replicas of the file."""
+        return as_replicas(self.uri)
+
+    def _metadata_pointer(self, name):
+        """Return pointer of metadata ``name`` stored next to the URI.
+
+        Replicas share the metadata of their document.  Top-level
+        documents have no object of their own to hold it, so their
+        metadata would be shared by all of them.
+        """
+        parent, token = self.pointer.rsplit('/', 1)
+        if token.isdigit() and is_document_pointer(parent) and isinstance(
+            jsonpointer.resolve_pointer(self.record, parent, None), list
+        ):
+            parent = parent.rsplit('/', 1)[0]  # replica of a document
+        if not parent:
+            raise ValueError(
+                'Document {0} can not store {1}, use a nested pointer '
+                'such as /files/0/uri.'.format(self.pointer, name)
+            )
+        return parent + '/' + name
+
+    @property
+    def checksum_pointer(self):
+        """Pointer to the checksum stored next to the URI."""
+        return self._metadata_pointer('checksum')
+
+    @property
+    def checksum(self):
+        """Read checksum stored next to the URI, e.g. ``md5:<hexdigest>``.
+
+        Top-level documents never have a checksum.
+        """
+        try:
+            pointer = self.checksum_pointer
+        except ValueError:
+            return None
+        return jsonpointer.resolve_pointer(self.record, pointer, None)
+
+    @checksum.setter
+    def checksum(self, value):
+        """Store checksum next to the URI."""
+        jsonpointer.set_pointer(self.record, self.checksum_pointer, value)
+
+    @property
+    def versions_pointer(self):
+        """Pointer to the list of versions stored next to the URI."""
+        return self._metadata_pointer('versions')
+
+    @property
+    def versions(self):
+        """Return list of previous and current versions.
+
+        Top-level documents are never versioned.
+        """
+        try:
+            pointer = self.versions_pointer
+        except ValueError:
+            return []
+        return jsonpointer.resolve_pointer(self.record, pointer, [])
+
+    @versions.setter
+    def versions(self, value):
+        """Store list of versions next to the URI."""
+        jsonpointer.set_pointer(self.record, self.versions_pointer, value)
+
+    def version(self, index):
+        """Return document pointing to the file of a version."""
+        return Document(
+            self.record, '{0}/{1}/uri'.format(self.versions_pointer, index)
+        )
+
+    def checkout(self, index):
+        """Point the document to the file of a previous version."""
+        version = self.versions[index]
+        self.checksum = version.get('checksum')
+        self.uri = version['uri']
+
+    @property
+    def ref(self):
+        """Return lightweight :class:`DocumentRef` of the document."""
+        return DocumentRef(getattr(self.record, 'id', None), self.pointer,
+                           self.uri)
+
+    def stat(self, refresh=False):
+        """Return size, modification time, checksum and MIME type.
+
+        Metadata comes from the :class:`~.models.DocumentStat` cache when
+        it is enabled.  Missing entries are read from storage without
+        being stored, so reading never writes to the database; only
+        ``refresh`` stores the entry and the ``documents stat`` command
+        fills the cache for existing files.  Replicated documents report
+        their first replica.
+        """
+        uri = self.replicas[0]
+        if not _stat_cache():
+            return DocumentStat.from_storage(uri, checksum=self.checksum)
+        if refresh:
+            return DocumentStat.refresh(uri, checksum=self.checksum)
+        stat = DocumentStat.get(uri)
+        if stat is None:
+            stat = DocumentStat.from_storage(uri, checksum=self.checksum)
+        return stat
 
     def open(self, mode='r', **kwargs):
-        """Open file ``uri`` under the pointer."""
-        _fs, filename = opener.parse(self.uri)
-        return _fs.open(filename, mode=mode, **kwargs)
+        """Open file ``uri`` under the pointer.
+
+        Small files opened in ``rb`` mode are served from the content
+        cache when it is enabled.  Replicated documents are read from
+        the fastest healthy replica.
+        """
+        if mode == 'rb' and not kwargs and not isinstance(self.uri, list):
+            fp = _open_cached(self.uri)
+            if fp is not None:
+                return fp
+
+        replicas = self.replicas
+        if set(mode) & set('wa+'):
+            release = locks.acquire(write=replicas)
+        else:
+            release = locks.acquire(read=replicas)
+        try:
+            if isinstance(self.uri, list):
+                fp = replication.open_replica(replicas, mode, **kwargs)
+            else:
+                _fs, filename = parse_uri(self.uri)
+                fp = policy.call((self.uri, ), lambda: _fs.open(
+                    filename, mode=mode, **kwargs
+                ), idempotent=True, read_only=not set(mode) & set('wa+'))
+        except Exception:
+            if release is not None:
+                release()
+            raise
+        return fp if release is None else locks.LockedFile(fp, release)
+
+    def iter_content(self, chunk_size=64 * 1024, start=0, end=None):
+        """Iterate over file content in chunks of ``chunk_size`` bytes.
+
+        Optional ``start`` and ``end`` offsets select a byte range, the
+        ``end`` offset being exclusive.  Drivers supporting ranges read
+        only the selected bytes from storage.
+        """
+        uri = self.uri
+        if (start or end is not None) and not isinstance(uri, list):
+            driver = get_driver(uri)
+            if driver.supports_range:
+                with locks.locked(read=(uri, )):
+                    fp = policy.call((uri, ), lambda: driver.open_range(
+                        uri, start, end
+                    ), idempotent=True, read_only=True)
+                    try:
+                        for chunk in iter(lambda: fp.read(chunk_size), b''):
+                            yield chunk
+                    finally:
+                        fp.close()
+                return
+
+        with self.open('rb') as fp:
+            if start:
+                fp.seek(start)
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                size = chunk_size if remaining is None \
+                    else min(chunk_size, remaining)
+                chunk = fp.read(size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def allocate_uri(self, base=None):
+        """Return URI for the file in the sharded layout under ``base``.
+
+        See :func:`invenio_documents.layout.allocate_document_uri`.
+        """
+        from .layout import allocate_document_uri
+        return allocate_document_uri(self, base)
+
+    def derivative(self, name):
+        """Return derivative ``name`` computed once per file content."""
+        from .proxies import current_documents
+        return current_documents.derivatives.get(self, name)
 
     def move(self, dst, **kwargs):
-        """Move file to a new destination and update ``uri``."""
-        _fs, filename = opener.parse(self.uri)
-        _fs_dst, filename_dst = opener.parse(dst)
-        movefile(_fs, filename, _fs_dst, filename_dst, **kwargs)
+        """Move file to a new destination and update ``uri``.
+
+        Replicated documents require a list with a destination for
+        every replica.
+        """
+        replicas = self.replicas
+        _check_movable(replicas)
+        destinations = as_replicas(dst)
+        if len(replicas) != len(destinations):
+            raise ValueError('Expected {0} destination(s).'.format(
+                len(replicas)
+            ))
+        for src, dst_replica in zip(replicas, destinations):
+            _move(src, dst_replica, **kwargs)
         self.uri = dst
 
     def copy(self, dst, **kwargs):
         """Copy file to a new destination.
 
         Returns JSON Patch with proposed change pointing to new copy.
+        Replicated documents are copied from the preferred replica.
         """
-        _fs, filename = opener.parse(self.uri)
-        _fs_dst, filename_dst = opener.parse(dst)
-        copyfile(_fs, filename, _fs_dst, filename_dst, **kwargs)
+        _copy(replication.preferred(self.replicas), dst, **kwargs)
+        if _stat_cache():
+            DocumentStat.refresh(dst, checksum=self.checksum)
         return [{'op': 'replace', 'path': self.pointer, 'value': dst}]
 
-    def setcontents(self, source, **kwargs):
-        """Create a new file from a string or file-like object."""
+    def setcontents(self, source, delta=False, versioned=False, **kwargs):
+        """Create a new file from a string or file-like object.
+
+        File objects supporting ``readinto`` are streamed in chunks,
+        other objects are read at once.  Replicated documents read the
+        source once and write all replicas concurrently; replicas which
+        failed are dropped from the URI list, recorded under
+        ``stale_replicas`` next to it and a
+        :class:`~.errors.ReplicationError` is raised, so the record has
+        to be committed to keep the change.
+
+        With ``delta`` only blocks differing from the existing file are
+        rewritten (see :mod:`invenio_documents.delta`) and the number of
+        bytes actually written is returned.  The stored checksum is
+        cleared as it no longer matches.  With ``versioned`` the
+        content is stored as a new immutable version instead (see
+        :mod:`invenio_documents.versions`).  Documents which already have
+        versions or point to a version object are always written as a
+        new version, since their files are shared.
+        """
         if isinstance(source, six.string_types):
-            _file = opener.open(source, 'rb')
+            with phase('fs open'):
+                _file = opener.open(source, 'rb')
         else:
             _file = source
 
-        # signals.document_before_content_set.send(self)
+        document_before_content_set.send(self)
 
-        data = _file.read()
-        _fs, filename = opener.parse(self.uri)
-        _fs.setcontents(filename, data, **kwargs)
-        _fs.close()
+        written = checksum = None
+        if versioned or self.versions or \
+                any(is_store_object(uri) for uri in self.replicas):
+            from .versions import add_version
+            checksum = add_version(self, _file, **kwargs)['checksum']
+        elif delta:
+            block_size = kwargs.pop(
+                'block_size', current_app.config['DOCUMENTS_DELTA_BLOCK_SIZE']
+            )
+            replicas = self.replicas
+            content = _file
+            position = _tell(_file) if len(replicas) > 1 else None
+            if len(replicas) > 1 and position is None:
+                content = TemporaryFile()
+                shutil.copyfileobj(_file, content, block_size)
+                content.seek(0)
+                position = 0
+            written = 0
+            for uri in replicas:
+                if position is not None:
+                    content.seek(position)
+                written += _setcontents(
+                    uri, content, delta=True, block_size=block_size, **kwargs
+                )
+            if content is not _file:
+                content.close()
+        elif isinstance(self.uri, list):
+            replicas = self.replicas
+            if not hasattr(_file, 'readinto'):
+                _file = BytesIO(_file.read())
+            try:
+                with locks.locked(write=replicas), \
+                        throttle.transfer(*replicas) as wrap, \
+                        phase('transfer'):
+                    replication.write_replicas(
+                        replicas, _file if wrap is None else wrap(_file),
+                        timeout=policy.get_timeout(replicas), **kwargs
+                    )
+            except ReplicationError as e:
+                self._drop_replicas(e.errors)
+                raise
+        else:
+            _setcontents(self.uri, _file, **kwargs)
 
-        # signals.document_after_content_set.send(self)
+        self._content_set(checksum)
 
         if isinstance(source, six.string_types) and hasattr(_file, 'close'):
             _file.close()
 
+        return written
+
+    def ingest(self, stream, max_size=None, content_length=None,
+               chunk_size=64 * 1024):
+        """Stream content of a request body or an iterator of chunks.
+
+        On local storage the content is written to a temporary file next
+        to the document which is renamed over it once complete, so an
+        interrupted upload or one larger than ``max_size`` bytes keeps
+        the previous content.  Other backends have no cheap rename and
+        would copy the whole file a second time, so the content is
+        streamed directly to the document instead and a failed upload
+        leaves it incomplete.  Replicated and versioned documents are
+        written by :meth:`setcontents`; replicas are replaced only once
+        the whole content was received, so they keep their previous
+        content as well.  Returns the number of bytes written.
+        """
+        if max_size is not None and content_length is not None and \
+                content_length > max_size:
+            raise ContentTooLargeError(
+                'Content exceeds {0} bytes.'.format(max_size)
+            )
+        reader = ChunkReader(stream, max_size=max_size,
+                             content_length=content_length)
+        source = io.BufferedReader(reader, chunk_size)
+        if isinstance(self.uri, list) or self.versions or \
+                is_store_object(self.uri):
+            self.setcontents(source)
+            return reader.size
+
+        document_before_content_set.send(self)
+        _fs, filename = parse_uri(self.uri)
+        try:
+            _fs.getsyspath(filename)
+        except NoSysPathError:
+            _setcontents(self.uri, source)
+            self._content_set()
+            return reader.size
+
+        temporary = _temporary_uri(self.uri, 'ingest')
+        try:
+            _setcontents(temporary, source)
+            _move(temporary, self.uri)
+        except Exception:
+            _fs, filename = parse_uri(temporary)
+            if _fs.exists(filename):
+                _fs.remove(filename)
+            raise
+        self._content_set()
+        return reader.size
+
+    def _content_set(self, checksum=None):
+        """Store ``checksum`` of new content and notify about it.
+
+        Without a known checksum the stored one is cleared, since it no
+        longer matches the content.
+        """
+        if self.checksum != checksum:
+            self.checksum = checksum
+        if _stat_cache():
+            for uri in self.replicas:
+                DocumentStat.refresh(uri, checksum=checksum)
+        document_after_content_set.send(self)
+
+    def _drop_replicas(self, failed):
+        """Stop reading replicas which failed to be written.
+
+        Nothing changes when all replicas failed.  Top-level documents
+        have no place for ``stale_replicas`` and just drop them.
+        """
+        replicas = self.replicas
+        written = [uri for uri in replicas if uri not in failed]
+        if not written:
+            return
+        try:
+            pointer = self._metadata_pointer('stale_replicas')
+        except ValueError:
+            pointer = None
+        if pointer is not None:
+            stale = jsonpointer.resolve_pointer(self.record, pointer, [])
+            jsonpointer.set_pointer(self.record, pointer, stale + [
+                uri for uri in replicas if uri in failed and uri not in stale
+            ])
+        self.uri = written
+        self._content_set()
+
     def remove(self, force=False):
         """Remove file reference from record.
 
-        If force is True it removes the file from filesystem
+        If force is True it removes the file (and all its replicas) from
+        filesystem together with the list of versions.  Objects of the
+        versions store are left to the garbage collector.
         """
         if force:
-            _fs, filename = opener.parse(self.uri)
-            _fs.remove(filename)
+            replicas = [uri for uri in self.replicas
+                        if not is_store_object(uri)]
+            for uri in replicas:
+                _remove(uri)
+            if self.versions:
+                self.versions = []
         self.uri = None
+
+
+class DocumentRef(namedtuple('DocumentRef', 'record_id pointer uri')):
+    """Lightweight reference to a document without its record.
+
+    References keep only the record identifier, the pointer and the URI
+    found when they were created, so millions of them can be processed
+    without keeping records in memory.
+    """
+
+    __slots__ = ()
+
+    def get_document(self, record=None):
+        """Return full :class:`Document` loading the record if needed."""
+        if record is None:
+            record = Record.get_record(self.record_id)
+        return Document(record, self.pointer)
+
+
+def stat_documents(documents):
+    """Return metadata of many documents as :meth:`Document.stat` does.
+
+    Cached entries are fetched with one query, so listings do not pay a
+    database round trip per document.
+    """
+    documents = list(documents)
+    cached = {}
+    if _stat_cache():
+        cached = DocumentStat.get_many(
+            document.replicas[0] for document in documents
+        )
+    return [cached.get(document.replicas[0]) or DocumentStat.from_storage(
+        document.replicas[0], checksum=document.checksum
+    ) for document in documents]
+
+
+def iter_document_refs(record_ids=None, batch_size=1000):
+    """Stream :class:`DocumentRef` of all documents in batches.
+
+    The URI index is read when it is enabled, otherwise the JSON of the
+    records is streamed and only the found URIs are kept.
+    """
+    if current_app.config['DOCUMENTS_URI_INDEX']:
+        query = db.session.query(
+            DocumentURI.record_id, DocumentURI.pointer, DocumentURI.uri
+        )
+        if record_ids is not None:
+            query = query.filter(DocumentURI.record_id.in_(list(record_ids)))
+        for row in query.order_by(
+            DocumentURI.record_id, DocumentURI.id
+        ).yield_per(batch_size):
+            yield DocumentRef(*row)
+    else:
+        for record_id, data in iter_records(ids=record_ids,
+                                            batch_size=batch_size):
+            for pointer, uri in iter_uris(data):
+                yield DocumentRef(record_id, pointer, uri)
+
+
+class DocumentBatch(object):
+    """Collect URI changes of many documents in one record.
+
+    Files are transferred immediately, but the record is patched only
+    once in :meth:`commit`.  Moves are performed as copies whose sources
+    are removed, together with forcefully removed files, in
+    :meth:`cleanup` after the transaction has been committed, so
+    :meth:`rollback` only needs to remove the new copies.  Copies
+    overwriting an existing file are staged under a temporary name and
+    swapped in by :meth:`commit`.
+    """
+
+    def __init__(self, record):
+        """Initialize an empty batch for ``record``."""
+        self.record = record
+        self.changes = OrderedDict()
+        self._created = []
+        self._obsolete = []
+        self._staged = OrderedDict()
+        self._replaced = []
+
+    def uri(self, pointer):
+        """Return URI under the pointer including pending changes."""
+        if pointer in self.changes:
+            return self.changes[pointer]
+        return Document(self.record, pointer).uri
+
+    def _source(self, pointer):
+        """Return URI holding the current content of the pointer."""
+        uri = self.uri(pointer)
+        return self._staged.get(uri, uri)
+
+    def copy(self, pointer, dst, **kwargs):
+        """Copy file to a new destination and point ``pointer`` to it.
+
+        Existing files are not overwritten unless ``overwrite`` is true,
+        in which case the copy replaces the destination only when the
+        batch is committed.
+        """
+        target = dst
+        if kwargs.pop('overwrite', False) and _exists(dst):
+            target = _temporary_uri(dst, 'batch')
+            self._staged[dst] = target
+        _copy(self._source(pointer), target, overwrite=False, **kwargs)
+        self._created.append(target)
+        self.changes[pointer] = dst
+
+    def move(self, pointer, dst, **kwargs):
+        """Move file to a new destination once the batch is committed."""
+        src = self.uri(pointer)
+        _check_movable((src, ))
+        self.copy(pointer, dst, **kwargs)
+        self._obsolete.append(src)
+
+    def remove(self, pointer, force=False):
+        """Remove file reference and optionally the file after commit."""
+        uri = self.uri(pointer)
+        if force and not is_store_object(uri):
+            self._obsolete.append(uri)
+        self.changes[pointer] = None
+
+    @property
+    def patch(self):
+        """Return merged JSON Patch with all collected changes."""
+        return [{'op': 'replace', 'path': pointer, 'value': value}
+                for pointer, value in six.iteritems(self.changes)]
+
+    def commit(self):
+        """Apply collected changes to the record and commit the session.
+
+        Replaced destinations are kept under a temporary name until
+        :meth:`cleanup`, so :meth:`rollback` can still restore them.
+        """
+        while self._staged:
+            dst, temporary = self._staged.popitem(last=False)
+            backup = _temporary_uri(dst, 'batch')
+            _move(dst, backup)
+            self._replaced.append((backup, dst))
+            _move(temporary, dst)
+            self._created.remove(temporary)
+        if self.changes:
+            self.record = self.record.patch(self.patch).commit()
+        db.session.commit()
+        return self.record
+
+    def rollback(self):
+        """Roll back the session and remove files created by the batch.
+
+        Destinations which existed before the batch are restored.
+        """
+        db.session.rollback()
+        for backup, dst in reversed(self._replaced):
+            _move(backup, dst)
+        for uri in reversed(self._created):
+            _remove(uri)
+        self._replaced = []
+        self._created = []
+        self._staged.clear()
+        self.changes.clear()
+
+    def cleanup(self):
+        """Remove files which are no longer referenced."""
+        obsolete = self._obsolete + [uri for uri, _ in self._replaced]
+        for uri in OrderedDict.fromkeys(obsolete):
+            _remove(uri)
+        self._obsolete = []
+        self._replaced = []
+
+
+@contextmanager
+def batch(record):
+    """Collect document changes and apply them in a single commit.
+
+    .. code-block:: python
+
+        with batch(record) as b:
+            b.move('/files/0/uri', '/data/a.pdf')
+            b.copy('/files/1/uri', '/data/b.pdf')
+        record = b.record
+
+    The database session is committed with the record, and files no
+    longer referenced are removed only afterwards.  If the block or the
+    commit fails, the session is rolled back, files already transferred
+    by the batch are removed and overwritten files are restored.
+    """
+    documents = DocumentBatch(record)
+    try:
+        yield documents
+        documents.commit()
+    except Exception:
+        documents.rollback()
+        raise
+    documents.cleanup()
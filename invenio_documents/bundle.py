@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Export and import record documents as a single tar bundle.
+
+For every exported record the bundle contains its files as
+``files/<record-id>/<n>/<name>`` members followed by a
+``records/<record-id>.json`` manifest entry holding the record metadata
+and the member of each document pointer.  Export writes the bundle as a
+stream, so it can be piped without temporary copies.  Import needs a
+seekable bundle because files are written in parallel, each worker
+reading its members directly at their offsets.
+"""
+
+from __future__ import absolute_import, print_function
+
+import io
+import json
+import posixpath
+import tarfile
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+import jsonpointer
+from flask import current_app
+from fs.opener import opener
+from fs.path import dirname
+from invenio_db import db
+from invenio_records.api import Record
+
+from .api import _setcontents
+from .pack import MemberFile
+from .storage import parse_uri
+from .utils import iter_records, iter_uris, join_uri
+
+
+def export_bundle(fileobj, record_ids=None):
+    """Write documents of records to ``fileobj`` as a tar stream.
+
+    Returns the number of exported records.
+    """
+    count = 0
+    with tarfile.open(fileobj=fileobj, mode='w|') as tar:
+        for record_id, data in iter_records(ids=record_ids):
+            documents = []
+            for index, (pointer, uri) in enumerate(iter_uris(data)):
+                _fs, filename = parse_uri(uri)
+                info = tarfile.TarInfo('files/{0}/{1}/{2}'.format(
+                    record_id, index, posixpath.basename(filename)
+                ))
+                info.size = _fs.getsize(filename)
+                with _fs.open(filename, 'rb') as fp:
+                    tar.addfile(info, fp)
+                documents.append({'pointer': pointer, 'member': info.name})
+
+            manifest = json.dumps({
+                'id': str(record_id),
+                'metadata': data,
+                'documents': documents,
+            }).encode('utf-8')
+            info = tarfile.TarInfo('records/{0}.json'.format(record_id))
+            info.size = len(manifest)
+            tar.addfile(info, io.BytesIO(manifest))
+            count += 1
+    return count
+
+
+def _write_member(task):
+    """Copy one bundle member to its destination URI.
+
+    The file is written directly, so versioned documents are restored
+    at their destination rather than in the versions store, and the
+    record owned by the importing thread is never touched.
+    """
+    app, path, offset, size, uri = task
+    with app.app_context():
+        with io.BufferedReader(
+            MemberFile(io.open(path, 'rb'), offset, size)
+        ) as fp:
+            _setcontents(uri, fp)
+        db.session.commit()
+    return uri
+
+
+def _drain(pending):
+    """Wait for pending writes, commit their records and yield them."""
+    imported = []
+    while pending:
+        old_id, record, results = pending.popleft()
+        for result in results:
+            result.get()
+        imported.append((old_id, record))
+    db.session.commit()
+    return imported
+
+
+def import_bundle(path, destination, workers=None, batch_size=100):
+    """Create records from a bundle and write their files.
+
+    Files are stored under the ``destination`` location.  The URIs of
+    each record are rewritten before the record is created, so every
+    record is stored only once.  Files are written by ``workers``
+    threads and records are committed in batches of ``batch_size`` once
+    all their files have been written.  Yields ``(old_id, record)``.
+    """
+    app = current_app._get_current_object()
+    dest_fs = opener.opendir(destination, writeable=True, create_dir=True)
+    pool = ThreadPool(workers)
+    pending = deque()
+    try:
+        with tarfile.open(path, mode='r:') as tar:
+            members = {}
+            for info in tar:
+                tar.members = []  # headers needed later are kept below
+                if info.name.startswith('files/'):
+                    members[info.name] = info
+                    continue
+                if not info.name.startswith('records/'):
+                    continue
+
+                manifest = json.loads(
+                    tar.extractfile(info).read().decode('utf-8')
+                )
+                data = manifest['metadata']
+                writes = []
+                for document in manifest['documents']:
+                    member = members.pop(document['member'])
+                    name = member.name[len('files/'):]
+                    dest_fs.makedir(dirname(name), recursive=True,
+                                    allow_recreate=True)
+                    uri = join_uri(destination, name)
+                    jsonpointer.set_pointer(data, document['pointer'], uri)
+                    writes.append((uri, member))
+
+                record = Record.create(data)
+                pending.append((manifest['id'], record, [
+                    pool.apply_async(_write_member, ((
+                        app, path, member.offset_data, member.size, uri,
+                    ), ))
+                    for uri, member in writes
+                ]))
+                if len(pending) >= batch_size:
+                    for item in _drain(pending):
+                        yield item
+        for item in _drain(pending):
+            yield item
+    finally:
+        pool.terminate()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""In-process cache of small document contents."""
+
+from __future__ import absolute_import, print_function
+
+import threading
+from collections import OrderedDict
+
+
+class ContentCache(object):
+    """Thread-safe LRU cache of file contents keyed by URI.
+
+    The cache is bounded both by the number of entries and by the total
+    size of cached contents.  Files larger than ``max_item_size`` are
+    never cached.  Readers filling a missing entry :meth:`reserve` it
+    first, so content read before a concurrent invalidation is dropped.
+    """
+
+    def __init__(self, max_entries, max_bytes, max_item_size):
+        """Initialize an empty cache."""
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_item_size = max_item_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Return number of cached entries."""
+        return len(self._data)
+
+    def get(self, uri):
+        """Return cached content of ``uri`` or ``None``."""
+        with self._lock:
+            data = self._data.pop(uri, None)
+            if data is None:
+                self.misses += 1
+                return None
+            self._data[uri] = data
+            self.hits += 1
+            return data
+
+    def reserve(self, uri):
+        """Return token for filling the missing entry of ``uri``.
+
+        Invalidating the entry revokes the token.
+        """
+        token = object()
+        with self._lock:
+            self._pending[uri] = token
+        return token
+
+    def release(self, uri, token):
+        """Forget ``token`` once the entry was filled or given up."""
+        with self._lock:
+            if self._pending.get(uri) is token:
+                del self._pending[uri]
+
+    def set(self, uri, data, token=None):
+        """Cache content of ``uri`` evicting least recently used entries.
+
+        With a ``token`` of :meth:`reserve` the content is only cached if
+        the entry was not invalidated since it was reserved.
+        """
+        if len(data) > self.max_item_size or len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if token is not None and self._pending.get(uri) is not token:
+                return
+            old = self._data.pop(uri, None)
+            if old is not None:
+                self.size -= len(old)
+            self._data[uri] = data
+            self.size += len(data)
+            while len(self._data) > self.max_entries or \
+                    self.size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted)
+
+    def invalidate(self, uri):
+        """Remove cached content of ``uri`` and revoke its reservation."""
+        with self._lock:
+            self._pending.pop(uri, None)
+            data = self._data.pop(uri, None)
+            if data is not None:
+                self.size -= len(data)
+
+    @property
+    def stats(self):
+        """Return hit-rate statistics."""
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / requests if requests else 0.0,
+            'entries': len(self._data),
+            'size': self.size,
+        }
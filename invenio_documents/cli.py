@@ -28,23 +28,74 @@ from __future__ import absolute_import, print_function
 
 import json
 import sys
+from collections import OrderedDict
 
 import click
+from flask import current_app
 from flask_cli import with_appcontext
+from invenio_db import db
 from invenio_records.api import Record
+from invenio_records.models import RecordMetadata
 
+from . import profiling
 from .api import Document
+from .bundle import export_bundle, import_bundle
+from .fixity import verify, write_report
+from .garbage import collect
+from .layout import rebalance
+from .loadtest import DEFAULT_MIX, run, serve_memory
+from .models import DocumentStat, DocumentURI
+from .pack import pack_documents
+from .profiling import Profiler
+from .removal import bulk_remove
+from .utils import is_store_object, is_version_pointer, \
+    iter_document_pointers, iter_record_pages, uri_scheme
 
 __all__ = (
+    'collect_garbage',
     'copy_document',
     'documents',
+    'export_documents',
+    'import_documents',
+    'load_test',
+    'lookup',
+    'pack',
+    'rebalance_documents',
+    'refresh_stats',
+    'reindex',
+    'remove_documents',
     'setcontents',
+    'verify_documents',
 )
 
 
 @click.group()
-def documents():
-    """Document management commands."""
+@click.option('--profile', is_flag=True, default=False)
+@click.option('--profile-output', type=click.Path(dir_okay=False))
+@click.pass_context
+def documents(ctx, profile, profile_output):
+    """Document management commands.
+
+    With ``--profile`` the time spent in each phase is reported on
+    standard error and ``--profile-output`` dumps :mod:`cProfile`
+    statistics readable by :mod:`pstats`.
+    """
+    if profile or profile_output:
+        profiler = Profiler(stats_file=profile_output)
+        ctx.meta['invenio_documents.profiler'] = profiler
+        profiling.activate(profiler)
+
+        @ctx.call_on_close
+        def report():
+            profiling.deactivate()
+            for line in profiler.report():
+                click.echo(line, err=True)
+
+
+def _get_record(identifier):
+    """Fetch record measuring the time spent."""
+    with profiling.phase('record fetch'):
+        return Record.get_record(identifier)
 
 
 @documents.command(name='cp')
@@ -54,7 +105,7 @@ def documents():
 @with_appcontext
 def copy_document(destination, identifier, pointer):
     """Copy file to a new destination."""
-    record = Record.get_record(identifier)
+    record = _get_record(identifier)
     click.echo(json.dumps(
         Document(record, pointer).copy(destination)
     ))
@@ -64,8 +115,289 @@ def copy_document(destination, identifier, pointer):
 @click.argument('source', type=click.File('rb'), default=sys.stdin)
 @click.option('-i', '--identifier')
 @click.option('-p', '--pointer')
+@click.option('--delta', is_flag=True, default=False)
 @with_appcontext
-def setcontents(source, identifier, pointer):
+def setcontents(source, identifier, pointer, delta):
     """Patch existing bibliographic record."""
-    record = Record.get_record(identifier)
-    Document(record, pointer).setcontents(source)
+    record = _get_record(identifier)
+    written = Document(record, pointer).setcontents(source, delta=delta)
+    if delta:
+        click.echo('{0} bytes written'.format(written))
+
+
+@documents.command(name='gc')
+@click.option('-r', '--root', 'roots', multiple=True)
+@click.option('-g', '--grace', type=int)
+@click.option('-w', '--workers', type=int)
+@click.option('--delete', is_flag=True, default=False)
+@with_appcontext
+def collect_garbage(roots, grace, workers, delete):
+    """Report or remove files not referenced by any record."""
+    config = current_app.config
+    for uri in collect(
+        roots or config['DOCUMENTS_GC_ROOTS'],
+        grace=config['DOCUMENTS_GC_GRACE_PERIOD'] if grace is None else grace,
+        delete=delete,
+        workers=workers or config['DOCUMENTS_GC_WORKERS'],
+    ):
+        click.echo(uri)
+
+
+@documents.command()
+@click.argument('uri')
+@with_appcontext
+def lookup(uri):
+    """List records and pointers referencing the URI."""
+    for entry in DocumentURI.lookup(uri):
+        click.echo('{0} {1}'.format(entry.record_id, entry.pointer))
+
+
+@documents.command()
+@click.option('-b', '--batch-size', type=int, default=1000)
+@with_appcontext
+def reindex(batch_size):
+    """Rebuild the index of URIs stored in records.
+
+    Entries are replaced record by record, so lookups keep working
+    during the rebuild.  Every page of records is committed on its own.
+    Entries of records which no longer exist are removed at the end.
+    """
+    for rows in iter_record_pages(batch_size=batch_size):
+        for record_id, data in rows:
+            DocumentURI.index_record(record_id, data or {})
+        db.session.commit()
+
+    DocumentURI.query.filter(~DocumentURI.record_id.in_(
+        db.session.query(RecordMetadata.id)
+    )).delete(synchronize_session=False)
+    db.session.commit()
+
+
+@documents.command(name='stat')
+@click.option('-i', '--identifier', 'identifiers', multiple=True)
+@click.option('-b', '--batch-size', type=int, default=1000)
+@click.option('--refresh', is_flag=True, default=False)
+@with_appcontext
+def refresh_stats(identifiers, batch_size, refresh):
+    """Store cached metadata of documents missing from the cache.
+
+    Fills the cache for files written before it was enabled.  With
+    ``--refresh`` the metadata of all documents is read again.
+    """
+    if not current_app.config['DOCUMENTS_STAT_CACHE']:
+        raise click.UsageError('DOCUMENTS_STAT_CACHE is not enabled.')
+    failures = 0
+    for rows in iter_record_pages(ids=identifiers or None,
+                                  batch_size=batch_size):
+        checksums = OrderedDict()
+        for _, data in rows:
+            for pointer, _ in iter_document_pointers(data or {}):
+                document = Document(data, pointer)
+                for uri in document.replicas:
+                    checksums.setdefault(uri, document.checksum)
+        cached = {} if refresh else DocumentStat.get_many(checksums)
+        for uri, checksum in checksums.items():
+            if uri in cached:
+                continue
+            try:
+                DocumentStat.refresh(uri, checksum=checksum)
+            except Exception as e:
+                failures += 1
+                click.echo('{0} {1}'.format(uri, e), err=True)
+        db.session.commit()
+    if failures:
+        sys.exit(1)
+
+
+@documents.command(name='verify')
+@click.option('-i', '--identifier', 'identifiers', multiple=True)
+@click.option('-o', '--output', type=click.File('w'), default='-')
+@click.option('-p', '--processes', type=int)
+@click.option('-a', '--all', 'show_all', is_flag=True, default=False)
+@with_appcontext
+def verify_documents(identifiers, output, processes, show_all):
+    """Verify checksums of stored documents."""
+    config = current_app.config
+    counts = write_report(verify(
+        record_ids=identifiers or None,
+        processes=processes or config['DOCUMENTS_FIXITY_PROCESSES'],
+        chunk_size=config['DOCUMENTS_FIXITY_CHUNK_SIZE'],
+        max_pending=config['DOCUMENTS_FIXITY_MAX_PENDING'],
+    ), output, show_all=show_all)
+    click.echo(' '.join(
+        '{0}={1}'.format(status, count)
+        for status, count in sorted(counts.items())
+    ), err=True)
+    if set(counts) - set(['ok']):
+        sys.exit(1)
+
+
+@documents.command()
+@click.argument('container')
+@click.option('-i', '--identifier', 'identifiers', multiple=True)
+@click.option('-s', '--max-size', type=int)
+@with_appcontext
+def pack(container, identifiers, max_size):
+    """Pack small documents of records into a container file."""
+    for identifier in identifiers:
+        record = _get_record(identifier)
+        documents = [Document(record, pointer)
+                     for pointer, uri in iter_document_pointers(record)
+                     if not isinstance(uri, list) and
+                     not is_version_pointer(pointer) and
+                     not is_store_object(uri) and uri_scheme(uri) != 'pack']
+        for document in pack_documents(documents, container,
+                                       max_size=max_size):
+            click.echo('{0} {1} {2}'.format(
+                identifier, document.pointer, document.uri
+            ))
+        with profiling.phase('commit'):
+            record.commit()
+    with profiling.phase('commit'):
+        db.session.commit()
+
+
+@documents.command(name='export')
+@click.option('-i', '--identifier', 'identifiers', multiple=True)
+@click.option('-o', '--output', type=click.File('wb'), default='-')
+@with_appcontext
+def export_documents(identifiers, output):
+    """Export records with their documents as a tar bundle."""
+    count = export_bundle(output, record_ids=identifiers or None)
+    click.echo('Exported {0} records.'.format(count), err=True)
+
+
+@documents.command(name='import')
+@click.argument('bundle', type=click.Path(exists=True, dir_okay=False))
+@click.argument('destination')
+@click.option('-w', '--workers', type=int)
+@with_appcontext
+def import_documents(bundle, destination, workers):
+    """Import records and documents from a tar bundle."""
+    for old_id, record in import_bundle(
+        bundle, destination,
+        workers=workers or current_app.config['DOCUMENTS_IMPORT_WORKERS'],
+    ):
+        click.echo('{0} {1}'.format(old_id, record.id))
+
+
+@documents.command(name='rebalance')
+@click.argument('base', required=False)
+@click.option('-i', '--identifier', 'identifiers', multiple=True)
+@click.option('-w', '--workers', type=int)
+@with_appcontext
+def rebalance_documents(base, identifiers, workers):
+    """Move documents into the sharded layout."""
+    failures = 0
+    for record_id, moved, error in rebalance(
+        base=base, record_ids=identifiers or None,
+        workers=workers or current_app.config['DOCUMENTS_LAYOUT_WORKERS'],
+    ):
+        for pointer, old_uri, new_uri in moved:
+            click.echo('{0} {1} {2} {3}'.format(
+                record_id, pointer, old_uri, new_uri
+            ))
+        if error is not None:
+            failures += 1
+            click.echo('{0} {1}'.format(record_id, error), err=True)
+    if failures:
+        sys.exit(1)
+
+
+def _read_batch(lines):
+    """Yield ``(record_id, pointer)`` pairs from lines of a batch file."""
+    for line in lines:
+        parts = line.split()
+        if parts:
+            yield parts[0], parts[1] if len(parts) > 1 else None
+
+
+@documents.command(name='rm')
+@click.option('-i', '--identifier')
+@click.option('-p', '--pointer')
+@click.option('--batch', 'batch_file', type=click.File('r'))
+@click.option('-f', '--force', is_flag=True, default=False)
+@click.option('-w', '--workers', type=int)
+@click.option('-b', '--batch-size', type=int, default=100)
+@with_appcontext
+def remove_documents(identifier, pointer, batch_file, force, workers,
+                     batch_size):
+    """Remove documents from records.
+
+    With ``--batch`` each line of the file contains a record identifier
+    optionally followed by a pointer; all documents of the record are
+    removed when the pointer is omitted.
+    """
+    if batch_file is not None:
+        items = _read_batch(batch_file)
+    elif identifier:
+        items = [(identifier, pointer)]
+    else:
+        raise click.UsageError('Missing --identifier or --batch.')
+
+    failures = 0
+    for result in bulk_remove(items, force=force, workers=workers,
+                              batch_size=batch_size):
+        if result.error is None:
+            click.echo('{0} {1} {2}'.format(
+                result.record_id, result.pointer, result.uri
+            ))
+        else:
+            failures += 1
+            click.echo('{0} {1} {2} {3}'.format(
+                result.record_id, result.pointer, result.uri, result.error
+            ), err=True)
+    if failures:
+        sys.exit(1)
+
+
+def _parse_mix(ctx, param, value):
+    """Parse ``name=weight`` pairs separated by commas."""
+    if not value:
+        return DEFAULT_MIX
+    try:
+        return dict((name.strip(), float(weight)) for name, weight in (
+            part.split('=', 1) for part in value.split(',')
+        ))
+    except ValueError:
+        raise click.BadParameter('Expected e.g. read=4,setcontents=1.')
+
+
+@documents.command(name='loadtest')
+@click.argument('target', required=False)
+@click.option('-m', '--mix', callback=_parse_mix)
+@click.option('-w', '--workers', type=int, default=4)
+@click.option('-n', '--requests', type=int, default=1000)
+@click.option('-f', '--files', type=int, default=10)
+@click.option('-s', '--file-size', type=int, default=64 * 1024)
+@click.option('--processes', is_flag=True, default=False)
+@click.option('--remote', is_flag=True, default=False)
+@with_appcontext
+def load_test(target, mix, workers, requests, files, file_size, processes,
+              remote):
+    """Measure throughput and latency of document operations.
+
+    Files are created under TARGET (a temporary directory by default).
+    With ``--remote`` they are stored in memory behind a local XML-RPC
+    server standing in for remote storage.
+    """
+    server = None
+    if remote:
+        server, target = serve_memory()
+    try:
+        stats = run(target, mix=mix, workers=workers, requests=requests,
+                    files=files, file_size=file_size, processes=processes)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    click.echo('{0:<12} {1:>8} {2:>6} {3:>10} {4:>9} {5:>9} {6:>9}'.format(
+        'operation', 'count', 'errors', 'ops/s', 'p50 ms', 'p95 ms', 'p99 ms'
+    ))
+    for item in stats:
+        click.echo('{0:<12} {1:>8} {2:>6} {3:>10.1f} {4} {5} {6}'.format(
+            item.operation, item.count, item.errors, item.throughput,
+            *('{0:>9.2f}'.format(value * 1000) if value is not None
+              else '{0:>9}'.format('-')
+              for value in (item.p50, item.p95, item.p99))
+        ))
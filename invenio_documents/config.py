@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Default configuration of Invenio-Documents."""
+
+from __future__ import absolute_import, print_function
+
+DOCUMENTS_URI_POINTERS = ['*/uri']
+"""Patterns of JSON Pointers holding document URIs in record metadata.
+
+Patterns use :mod:`fnmatch` syntax where ``*`` also matches ``/``, so
+the default finds ``/files/0/uri`` as well as ``/main/uri``.  Values are
+single URIs or lists of replica URIs; ``http`` and ``https`` URLs are
+never treated as documents.
+"""
+
+DOCUMENTS_GC_ROOTS = []
+"""Storage locations scanned by the garbage collector."""
+
+DOCUMENTS_GC_GRACE_PERIOD = 24 * 60 * 60
+"""Files modified less than this many seconds ago are never collected."""
+
+DOCUMENTS_GC_WORKERS = 8
+"""Number of threads scanning storage in parallel."""
+
+DOCUMENTS_URI_INDEX = False
+"""Maintain the reverse index from document URIs to records.
+
+When enabled every record commit rewrites the index entries of the
+record; run ``documents reindex`` after turning it on.
+"""
+
+DOCUMENTS_BANDWIDTH_LIMITS = {}
+"""Maximum transfer rate in bytes per second keyed by URI scheme.
+
+Plain filesystem paths use the ``file`` scheme, e.g.
+``{'file': 50 * 1024 * 1024}``.
+"""
+
+DOCUMENTS_CONCURRENCY_LIMITS = {}
+"""Maximum number of concurrent transfers keyed by URI scheme."""
+
+DOCUMENTS_FIXITY_PROCESSES = None
+"""Number of processes hashing files (defaults to the number of CPUs)."""
+
+DOCUMENTS_FIXITY_CHUNK_SIZE = 1024 * 1024
+"""Number of bytes read from storage at once while hashing."""
+
+DOCUMENTS_FIXITY_MAX_PENDING = 1000
+"""Maximum number of files queued for hashing processes."""
+
+DOCUMENTS_DERIVATIVES = {}
+"""Derivative transforms keyed by name.
+
+Values are callables or import paths of callables receiving an open
+binary file and returning the derivative as bytes.
+"""
+
+DOCUMENTS_DERIVATIVES_CACHE_DIR = None
+"""Directory of the derivative cache (defaults to the instance folder)."""
+
+DOCUMENTS_DERIVATIVES_CACHE_SIZE = 1024 * 1024 * 1024
+"""Maximum size of the derivative cache in bytes."""
+
+DOCUMENTS_CONTENT_CACHE = False
+"""Cache contents of small documents opened in ``rb`` mode in memory."""
+
+DOCUMENTS_CONTENT_CACHE_MAX_ENTRIES = 1000
+"""Maximum number of documents kept in the content cache."""
+
+DOCUMENTS_CONTENT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+"""Maximum total size of the content cache in bytes."""
+
+DOCUMENTS_CONTENT_CACHE_MAX_ITEM_SIZE = 256 * 1024
+"""Documents larger than this many bytes are never cached."""
+
+DOCUMENTS_STAT_CACHE = False
+"""Cache size, modification time and MIME type of written documents.
+
+Entries are stored when documents are written, copied or moved through
+the API; files changed by other means report stale metadata.  Existing
+files are added with ``documents stat``.
+"""
+
+DOCUMENTS_INGEST_MAX_SIZE = None
+"""Maximum size in bytes of request bodies written to documents."""
+
+DOCUMENTS_IMPORT_WORKERS = 8
+"""Number of threads writing files when importing a bundle."""
+
+DOCUMENTS_DRIVERS = {}
+"""Storage drivers keyed by URI scheme.
+
+Values are :class:`~invenio_documents.drivers.Driver` factories or their
+import paths.  They take precedence over the drivers registered under
+the ``invenio_documents.drivers`` entry point group.
+"""
+
+DOCUMENTS_STORAGE_POLICIES = {}
+"""Timeout, retry and circuit-breaker policies keyed by URI scheme.
+
+Example:
+
+.. code-block:: python
+
+    DOCUMENTS_STORAGE_POLICIES = {
+        'ftp': {
+            'timeout': 30,  # seconds to open or without transfer progress
+            'retries': 3,  # only for idempotent operations
+            'backoff': 0.5,  # initial delay between retries
+            'max_backoff': 30,
+            'failure_threshold': 5,  # failures opening the circuit
+            'reset_timeout': 60,  # seconds before a trial call
+        },
+    }
+"""
+
+DOCUMENTS_REPLICA_BACKENDS = []
+"""URI prefixes identifying storage backends of document replicas.
+
+Read latency and failures are tracked per backend in order to pick the
+preferred replica, e.g. ``['/mnt/storage1/', '/mnt/storage2/']``.
+"""
+
+DOCUMENTS_LAYOUT_BASE = None
+"""Base location of documents allocated in the sharded layout."""
+
+DOCUMENTS_LAYOUT_DEPTH = 2
+"""Number of directory levels of the sharded layout."""
+
+DOCUMENTS_LAYOUT_WIDTH = 2
+"""Hexadecimal characters per level (fan-out of ``16 ** width``)."""
+
+DOCUMENTS_LAYOUT_WORKERS = 8
+"""Number of threads moving documents when rebalancing."""
+
+DOCUMENTS_DELTA_BLOCK_SIZE = 64 * 1024
+"""Block size in bytes compared by delta updates of document contents."""
+
+DOCUMENTS_VERSIONS_STORE = None
+"""Location of immutable objects written by versioned ``setcontents``."""
+
+DOCUMENTS_LOCK_MANAGER = None
+"""Lock manager serializing writers of the same document URI.
+
+Use ``'local'`` for locks shared by threads of one process, ``'file'``
+for locks shared by processes of one host, or an import path of a
+:class:`~invenio_documents.locks.LockManager` factory receiving the
+application.  Locking is disabled by default.
+"""
+
+DOCUMENTS_LOCK_DIR = None
+"""Directory of file locks (defaults to ``<instance path>/locks``)."""
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Delta updates rewriting only the changed blocks of existing files.
+
+The existing file is split into blocks whose weak (Adler-32) and strong
+(MD5) checksums form its signature.  The new content is then read block
+by block and only blocks whose checksums differ from the block at the
+same offset are written, after which the file is truncated to the new
+size.
+
+Unlike rsync there is no rolling match: blocks are only compared at the
+same offset, so an insertion or deletion rewrites everything after it.
+This suits files changed in place, such as appended logs or records of
+a fixed size.  The file is also rewritten in place rather than replaced,
+so a reader not holding the document lock (see
+``DOCUMENTS_LOCK_MANAGER``) or a failure during the update can observe a
+mix of old and new blocks.
+"""
+
+from __future__ import absolute_import, print_function
+
+import hashlib
+import io
+import zlib
+
+from fs.errors import FSError, NoSysPathError
+
+
+def read_block(fileobj, size):
+    """Read ``size`` bytes unless the end of ``fileobj`` is reached."""
+    chunks = []
+    while size > 0:
+        chunk = fileobj.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def weak_checksum(block):
+    """Return Adler-32 checksum of ``block``."""
+    return zlib.adler32(block) & 0xffffffff
+
+
+def strong_checksum(block):
+    """Return MD5 digest of ``block``."""
+    return hashlib.md5(block).digest()
+
+
+def signature(fileobj, block_size):
+    """Return list of ``(weak, strong)`` checksums of blocks."""
+    return [
+        (weak_checksum(block), strong_checksum(block))
+        for block in iter(lambda: read_block(fileobj, block_size), b'')
+    ]
+
+
+def apply_delta(target, source, block_size):
+    """Update seekable ``target`` in place with content of ``source``.
+
+    Blocks are compared at the same offset only and the update is not
+    atomic.  Returns the number of bytes actually written.
+    """
+    target.seek(0)
+    blocks = signature(target, block_size)
+    written = offset = 0
+    for index, block in enumerate(
+        iter(lambda: read_block(source, block_size), b'')
+    ):
+        if index >= len(blocks) or \
+                blocks[index][0] != weak_checksum(block) or \
+                blocks[index][1] != strong_checksum(block):
+            target.seek(offset)
+            target.write(block)
+            written += len(block)
+        offset += len(block)
+    target.truncate(offset)
+    return written
+
+
+def open_target(_fs, filename):
+    """Open existing file for in-place update or return ``None``."""
+    if not _fs.exists(filename):
+        return None
+    try:
+        return io.open(_fs.getsyspath(filename), 'r+b')
+    except NoSysPathError:
+        pass
+    try:
+        fileobj = _fs.open(filename, 'r+b')
+    except FSError:
+        return None
+    if getattr(fileobj, 'seekable', lambda: False)() and \
+            hasattr(fileobj, 'truncate'):
+        return fileobj
+    fileobj.close()
+    return None
+
+
+def update(_fs, filename, source, block_size=64 * 1024, **kwargs):
+    """Write ``source`` to ``filename`` rewriting only changed blocks.
+
+    The whole content is written when the file does not exist yet or the
+    backend does not support in-place updates.  Returns the number of
+    bytes actually written.
+    """
+    target = open_target(_fs, filename)
+    if target is None:
+        _fs.setcontents(filename, source, **kwargs)
+        return _fs.getsize(filename)
+    with target:
+        return apply_delta(target, source, block_size)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Cache of derivatives (thumbnails, extracted text, ...) of documents.
+
+A derivative is produced by a named transform which receives an open
+binary file and returns bytes.  The result is computed once and stored
+in a local directory until the underlying file changes, which is
+detected through document signals.  Entries are also keyed by the
+checksum, or the size and modification time, of the file, so changes
+made behind the back of the signals are never served.  The least
+recently used entries are evicted down to a low-water mark once the
+cache grows over its maximum size.
+"""
+
+from __future__ import absolute_import, print_function
+
+import hashlib
+import os
+import tempfile
+import threading
+
+
+class DerivativeCache(object):
+    """Filesystem cache of named document derivatives."""
+
+    def __init__(self, directory, max_size, low_water=0.9):
+        """Initialize cache stored in ``directory``.
+
+        Eviction frees space down to ``low_water`` times ``max_size``.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.low_water = low_water
+        self.transforms = {}
+        self._lock = threading.Lock()
+        self._size = None
+
+    def register(self, name, transform):
+        """Register ``transform`` producing derivative ``name``."""
+        self.transforms[name] = transform
+
+    def _uri_path(self, uri):
+        """Return cache directory of all derivatives of ``uri``."""
+        key = hashlib.sha1(uri.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self):
+        """Yield ``(mtime, size, path)`` of all cached derivatives."""
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    @property
+    def size(self):
+        """Return total size of cached derivatives."""
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        return self._size
+
+    @staticmethod
+    def _version(document):
+        """Return key identifying the current content of the document."""
+        stat = document.stat()
+        token = stat.checksum or '{0}-{1}'.format(stat.size, stat.mtime)
+        return hashlib.sha1(token.encode('utf-8')).hexdigest()
+
+    def get(self, document, name):
+        """Return derivative ``name`` of the document."""
+        path = os.path.join(
+            self._uri_path(document.replicas[0]),
+            '{0}.{1}'.format(name, self._version(document)),
+        )
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            os.utime(path, None)
+            return data
+        except (IOError, OSError):
+            pass
+
+        with document.open('rb') as fp:
+            data = self.transforms[name](fp)
+        self._store(path, data)
+        return data
+
+    def _store(self, path, data):
+        """Atomically write derivative and evict old entries."""
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        os.rename(tmp, path)
+
+        with self._lock:
+            self._size = self.size + len(data)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """Remove least recently used derivatives down to the low-water mark.
+
+        Freeing more space than needed makes the cache directory walked
+        once per many new derivatives instead of for every one of them.
+        """
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        target = self.max_size * self.low_water
+        for _, size, path in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+    def invalidate(self, uri):
+        """Remove all derivatives of ``uri``."""
+        directory = self._uri_path(uri)
+        if not os.path.isdir(directory):
+            return
+        with self._lock:
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                except OSError:
+                    continue
+                if self._size is not None:
+                    self._size -= size
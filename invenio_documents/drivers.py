@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Registry of storage drivers keyed by URI scheme.
+
+Drivers are registered under the ``invenio_documents.drivers`` entry
+point group with the URI scheme as name, or in ``DOCUMENTS_DRIVERS``.
+Schemes without a driver use the generic :mod:`fs.opener` registry.
+Document operations check the capabilities of the driver to pick the
+fastest way of reading byte ranges, copying and removing files.
+"""
+
+from __future__ import absolute_import, print_function
+
+import threading
+
+import pkg_resources
+import six
+from flask import current_app, has_app_context
+from fs.errors import DestinationExistsError, ResourceNotFoundError
+from fs.opener import opener
+from werkzeug.utils import import_string
+
+from .errors import DocumentsError
+from .utils import uri_scheme
+
+BUILTIN_DRIVERS = {
+    'pack': 'invenio_documents.pack:PackDriver',
+    's3': 'invenio_documents.drivers:S3Driver',
+}
+"""Drivers shipped with the package, also used without installed metadata."""
+
+
+class Driver(object):
+    """Generic driver resolving URIs with :mod:`fs.opener`.
+
+    Subclasses enable capabilities and implement the matching methods.
+    """
+
+    supports_range = False
+    """Driver reads byte ranges without fetching the whole file."""
+
+    supports_server_copy = False
+    """Driver copies files inside the storage without a transfer."""
+
+    supports_batch_delete = False
+    """Driver removes many files with a single request."""
+
+    def parse(self, uri):
+        """Return ``(fs, path)`` of the file identified by ``uri``."""
+        return opener.parse(uri)
+
+    def open_range(self, uri, start, end=None):
+        """Open file with content from ``start`` to exclusive ``end``."""
+        raise NotImplementedError()
+
+    def server_copy(self, src, dst, overwrite=True, **kwargs):
+        """Copy file between two URIs of the storage.
+
+        An existing ``dst`` is replaced only when ``overwrite`` is true.
+        """
+        raise NotImplementedError()
+
+    def remove_many(self, uris):
+        """Remove files and return list of ``(uri, error)``."""
+        raise NotImplementedError()
+
+
+class S3Driver(Driver):
+    """Amazon S3 driver sending requests through :mod:`boto`.
+
+    URIs have the form ``s3://<bucket>/<key>`` understood by
+    :mod:`fs.opener`.  Ranges, copies and deletes are sent through
+    ``connection``, by default one made by :func:`boto.connect_s3`, so
+    the driver does not depend on internals of :class:`fs.s3fs.S3FS`.
+    """
+
+    supports_range = True
+    supports_server_copy = True
+    supports_batch_delete = True
+
+    def __init__(self, connection=None):
+        """Initialize driver using ``connection`` to S3."""
+        self._connection = connection
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, name):
+        """Return bucket ``name`` of the connection."""
+        with self._lock:
+            if self._connection is None:
+                import boto
+                self._connection = boto.connect_s3()
+            if name not in self._buckets:
+                self._buckets[name] = self._connection.get_bucket(
+                    name, validate=False
+                )
+            return self._buckets[name]
+
+    @staticmethod
+    def split(uri):
+        """Return ``(bucket, key)`` of an ``s3://`` URI."""
+        bucket, _, key = uri.split('://', 1)[1].partition('/')
+        return bucket, key
+
+    def open_range(self, uri, start, end=None):
+        """Open the key with a ``Range`` request header."""
+        bucket, key_name = self.split(uri)
+        key = self.bucket(bucket).get_key(key_name)
+        if key is None:
+            raise ResourceNotFoundError(uri)
+        key.open_read(headers={'Range': 'bytes={0}-{1}'.format(
+            start, '' if end is None else end - 1
+        )})
+        return key
+
+    def server_copy(self, src, dst, overwrite=True, **kwargs):
+        """Copy the key inside S3."""
+        src_bucket, src_key = self.split(src)
+        dst_bucket, dst_key = self.split(dst)
+        bucket = self.bucket(dst_bucket)
+        if not overwrite and bucket.get_key(dst_key) is not None:
+            raise DestinationExistsError(dst)
+        bucket.copy_key(dst_key, src_bucket, src_key)
+
+    def remove_many(self, uris):
+        """Remove keys with multi-object deletes of one bucket each."""
+        buckets = {}
+        for uri in uris:
+            bucket, key = self.split(uri)
+            buckets.setdefault(bucket, []).append((uri, key))
+        results = []
+        for bucket, items in buckets.items():
+            result = self.bucket(bucket).delete_keys(
+                [key for _, key in items]
+            )
+            failed = dict((error.key, DocumentsError(error.message))
+                          for error in result.errors)
+            results.extend((uri, failed.get(key)) for uri, key in items)
+        return results
+
+
+def load_drivers(config=None):
+    """Return driver instances keyed by scheme.
+
+    Built-in drivers are overridden by entry points which are in turn
+    overridden by ``config``.
+    """
+    factories = dict(BUILTIN_DRIVERS)
+    for entry_point in pkg_resources.iter_entry_points(
+        'invenio_documents.drivers'
+    ):
+        factories[entry_point.name] = entry_point.load()
+    factories.update(config or {})
+
+    drivers = {}
+    for scheme, factory in factories.items():
+        if isinstance(factory, six.string_types):
+            factory = import_string(factory)
+        drivers[scheme.lower()] = factory()
+    return drivers
+
+
+_default_drivers = None
+_generic = Driver()
+
+
+def get_driver(uri):
+    """Return driver of the scheme of ``uri``."""
+    global _default_drivers
+    ext = current_app.extensions.get('invenio-documents') \
+        if has_app_context() else None
+    drivers = getattr(ext, 'drivers', None)
+    if drivers is None:
+        if _default_drivers is None:
+            _default_drivers = load_drivers()
+        drivers = _default_drivers
+    return drivers.get(uri_scheme(uri), _generic)
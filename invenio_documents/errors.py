@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Errors raised by document operations."""
+
+from __future__ import absolute_import, print_function
+
+
+class DocumentsError(Exception):
+    """Base class for Invenio-Documents errors."""
+
+
+class StorageTimeoutError(DocumentsError):
+    """Storage operation did not finish within the configured timeout."""
+
+
+class CircuitOpenError(DocumentsError):
+    """Storage backend failed repeatedly and is not used for a while."""
+
+
+class ContentTooLargeError(DocumentsError):
+    """Ingested content exceeds the size limit."""
+
+
+class IncompleteContentError(DocumentsError):
+    """Ingested stream ended before the announced content length."""
+
+
+class ReplicationError(DocumentsError):
+    """Writing to some replicas of a document failed."""
+
+    def __init__(self, errors):
+        """Initialize with errors keyed by replica URI."""
+        super(ReplicationError, self).__init__(
+            'Writing to {0} replica(s) failed.'.format(len(errors))
+        )
+        self.errors = errors
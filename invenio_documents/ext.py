@@ -26,7 +26,17 @@
 
 from __future__ import absolute_import, print_function
 
+import os
+
+import six
+from werkzeug.utils import import_string
+
+from . import config
+from .cache import ContentCache
 from .cli import documents as cmd
+from .derivatives import DerivativeCache
+from .drivers import load_drivers
+from .locks import FileLockManager, LocalLockManager
 
 
 class InvenioDocuments(object):
@@ -34,10 +44,123 @@ class InvenioDocuments(object):
 
     def __init__(self, app=None):
         """Extension initialization."""
+        self.derivatives = None
+        self.content_cache = None
+        self.lock_manager = None
+        self.drivers = None
         if app:
             self.init_app(app)
 
     def init_app(self, app):
         """Flask application initialization."""
+        self.init_config(app)
+        self.drivers = load_drivers(app.config['DOCUMENTS_DRIVERS'])
         app.extensions['invenio-documents'] = self
         app.cli.add_command(cmd)
+        self.init_derivatives(app)
+        self.init_content_cache(app)
+        self.init_locks(app)
+        if app.config['DOCUMENTS_URI_INDEX']:
+            self.register_signals()
+
+    def init_config(self, app):
+        """Initialize configuration."""
+        for k in dir(config):
+            if k.startswith('DOCUMENTS_'):
+                app.config.setdefault(k, getattr(config, k))
+
+    @property
+    def cache_stats(self):
+        """Return statistics of the content cache if enabled."""
+        if self.content_cache is not None:
+            return self.content_cache.stats
+
+    @property
+    def lock_stats(self):
+        """Return lock wait statistics if locking is enabled."""
+        if self.lock_manager is not None:
+            return self.lock_manager.stats.as_dict()
+
+    @staticmethod
+    def register_signals():
+        """Connect receivers maintaining the URI index."""
+        from invenio_records.signals import after_record_delete, \
+            after_record_insert, after_record_update
+
+        from .receivers import delete_record_uris, index_document_uri, \
+            index_record_uris
+        from .signals import document_uri_changed
+
+        document_uri_changed.connect(index_document_uri)
+        after_record_insert.connect(index_record_uris)
+        after_record_update.connect(index_record_uris)
+        after_record_delete.connect(delete_record_uris)
+
+    @staticmethod
+    def unregister_signals():
+        """Disconnect receivers maintaining the URI index."""
+        from invenio_records.signals import after_record_delete, \
+            after_record_insert, after_record_update
+
+        from .receivers import delete_record_uris, index_document_uri, \
+            index_record_uris
+        from .signals import document_uri_changed
+
+        document_uri_changed.disconnect(index_document_uri)
+        after_record_insert.disconnect(index_record_uris)
+        after_record_update.disconnect(index_record_uris)
+        after_record_delete.disconnect(delete_record_uris)
+
+    def init_derivatives(self, app):
+        """Initialize derivative cache and its invalidation."""
+        from .receivers import invalidate_changed_derivatives, \
+            invalidate_moved_derivatives
+        from .signals import document_after_content_set, \
+            document_uri_changed
+
+        self.derivatives = DerivativeCache(
+            app.config['DOCUMENTS_DERIVATIVES_CACHE_DIR'] or
+            os.path.join(app.instance_path, 'derivatives'),
+            app.config['DOCUMENTS_DERIVATIVES_CACHE_SIZE'],
+        )
+        for name, transform in app.config['DOCUMENTS_DERIVATIVES'].items():
+            if isinstance(transform, six.string_types):
+                transform = import_string(transform)
+            self.derivatives.register(name, transform)
+
+        document_uri_changed.connect(invalidate_moved_derivatives)
+        document_after_content_set.connect(invalidate_changed_derivatives)
+
+    def init_content_cache(self, app):
+        """Initialize in-memory cache of small documents."""
+        from .receivers import invalidate_content_cache
+        from .signals import document_after_content_set, \
+            document_uri_changed
+
+        self.content_cache = None
+        if not app.config['DOCUMENTS_CONTENT_CACHE']:
+            return
+        self.content_cache = ContentCache(
+            app.config['DOCUMENTS_CONTENT_CACHE_MAX_ENTRIES'],
+            app.config['DOCUMENTS_CONTENT_CACHE_MAX_BYTES'],
+            app.config['DOCUMENTS_CONTENT_CACHE_MAX_ITEM_SIZE'],
+        )
+        document_uri_changed.connect(invalidate_content_cache)
+        document_after_content_set.connect(invalidate_content_cache)
+
+    def init_locks(self, app):
+        """Initialize the per-URI lock manager."""
+        manager = app.config['DOCUMENTS_LOCK_MANAGER']
+        if manager is None:
+            self.lock_manager = None
+        elif manager == 'local':
+            self.lock_manager = LocalLockManager()
+        elif manager == 'file':
+            self.lock_manager = FileLockManager(
+                app.config['DOCUMENTS_LOCK_DIR'] or
+                os.path.join(app.instance_path, 'locks')
+            )
+        else:
+            if isinstance(manager, six.string_types):
+                manager = import_string(manager)
+            self.lock_manager = manager(app)
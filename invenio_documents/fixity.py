@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Verify integrity of stored documents against recorded checksums.
+
+Checksums are stored next to the URI (see
+:attr:`invenio_documents.api.Document.checksum`) in the form
+``<algorithm>:<hexdigest>``.  Files are streamed and hashed by a pool of
+worker processes, each of them reading and hashing one file at a time.
+"""
+
+from __future__ import absolute_import, print_function
+
+import hashlib
+from collections import deque, namedtuple
+from multiprocessing import Pool
+
+from fs.errors import ResourceNotFoundError
+
+from .api import Document
+from .storage import parse_uri
+from .utils import iter_document_pointers, iter_records, iter_replicas
+
+FixityResult = namedtuple(
+    'FixityResult', ('record_id', 'pointer', 'uri', 'status', 'checksum')
+)
+"""Result of a single document verification."""
+
+
+def compute_checksum(uri, algorithm='md5', chunk_size=1024 * 1024):
+    """Stream file content and return its ``<algorithm>:<hexdigest>``."""
+    digest = hashlib.new(algorithm)
+    _fs, filename = parse_uri(uri)
+    with _fs.open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            digest.update(chunk)
+    return '{0}:{1}'.format(algorithm, digest.hexdigest())
+
+
+def verify_checksum(task):
+    """Compare checksum of a file with the expected value."""
+    record_id, pointer, uri, expected, chunk_size = task
+    algorithm = expected.split(':', 1)[0]
+    try:
+        checksum = compute_checksum(uri, algorithm, chunk_size)
+    except ResourceNotFoundError:
+        return FixityResult(record_id, pointer, uri, 'missing', None)
+    except Exception:
+        return FixityResult(record_id, pointer, uri, 'error', None)
+    status = 'ok' if checksum == expected else 'mismatch'
+    return FixityResult(record_id, pointer, uri, status, checksum)
+
+
+def iter_checksums(record_ids=None, batch_size=1000):
+    """Yield ``(record_id, pointer, uri, checksum)`` of stored documents.
+
+    Every replica is yielded with the checksum of its document.
+    """
+    for record_id, data in iter_records(ids=record_ids,
+                                        batch_size=batch_size):
+        for pointer, value in iter_document_pointers(data):
+            checksum = Document(data, pointer).checksum
+            if checksum:
+                for replica_pointer, uri in iter_replicas(value, pointer):
+                    yield record_id, replica_pointer, uri, checksum
+
+
+def verify(record_ids=None, processes=None, chunk_size=1024 * 1024,
+           max_pending=1000):
+    """Verify all documents with a stored checksum.
+
+    Files are hashed by ``processes`` worker processes reading
+    ``chunk_size`` bytes at a time.  At most ``max_pending`` files are
+    queued for the workers, so records are streamed from the database
+    while hashing is in progress.  Yields :class:`FixityResult` in the
+    order the documents were found.
+    """
+    pool = Pool(processes)
+    pending = deque()
+    try:
+        for record_id, pointer, uri, checksum in iter_checksums(record_ids):
+            pending.append(pool.apply_async(
+                verify_checksum,
+                ((record_id, pointer, uri, checksum, chunk_size), )
+            ))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def write_report(results, output, show_all=False):
+    """Write tab separated report and return counts of each status.
+
+    Only failed verifications are written unless ``show_all`` is set.
+    """
+    counts = {}
+    for result in results:
+        counts[result.status] = counts.get(result.status, 0) + 1
+        if show_all or result.status != 'ok':
+            output.write(u'{0}\t{1}\t{2}\t{3}\n'.format(
+                result.status, result.record_id, result.pointer, result.uri
+            ))
+    return counts
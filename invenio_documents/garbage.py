@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Collect files which are no longer referenced by any record.
+
+Removing a document without ``force`` or replacing a URI after a copy
+leaves the original file behind.  The collector builds the set of URIs
+referenced by records, walks the configured storage roots in parallel
+and reports (or removes) every file which is not referenced and is older
+than the grace period.
+"""
+
+from __future__ import absolute_import, print_function
+
+import datetime
+from multiprocessing.pool import ThreadPool
+
+from fs.opener import opener
+
+from .pack import parse_pack_uri
+from .utils import is_under, iter_records, iter_uris, join_uri, \
+    normalize_uri, uri_scheme
+
+
+def referenced_uris(prefixes=None, batch_size=1000):
+    """Return the set of normalized URIs referenced by records.
+
+    Records are streamed in batches and only URIs inside one of
+    ``prefixes`` are kept, so the set is proportional to the scanned
+    storage rather than to the whole database.  A member of a pack
+    container keeps the container and its index referenced.  URIs are
+    normalized with :func:`~invenio_documents.utils.normalize_uri`.
+    """
+    prefixes = [normalize_uri(prefix) for prefix in prefixes or ()]
+    uris = set()
+    for _, data in iter_records(batch_size=batch_size):
+        for _, uri in iter_uris(data):
+            if uri_scheme(uri) == 'pack':
+                container_uri, _ = parse_pack_uri(uri)
+                candidates = (container_uri, container_uri + '.index')
+            else:
+                candidates = (uri, )
+            for candidate in candidates:
+                candidate = normalize_uri(candidate)
+                if not prefixes or any(is_under(candidate, prefix)
+                                       for prefix in prefixes):
+                    uris.add(candidate)
+    return uris
+
+
+def _changed_since(root_fs, filename, cutoff):
+    """Check if the file was modified or renamed after ``cutoff``.
+
+    Renames keep the modification time, but update the change time
+    reported as ``created_time`` by local filesystems on POSIX.
+    """
+    info = root_fs.getinfo(filename)
+    times = [time for time in (info.get('modified_time'),
+                               info.get('created_time')) if time is not None]
+    return not times or max(times) > cutoff
+
+
+def _scan(task):
+    """Scan one directory of a storage root and return its orphans."""
+    root, root_fs, path, recursive, referenced, cutoff = task
+    if recursive:
+        filenames = root_fs.walkfiles(path)
+    else:
+        filenames = root_fs.listdir(path, absolute=True, files_only=True)
+
+    orphans = []
+    for filename in filenames:
+        uri = join_uri(root, filename)
+        if normalize_uri(uri) in referenced:
+            continue
+        if cutoff is not None and _changed_since(root_fs, filename, cutoff):
+            continue
+        orphans.append((root_fs, filename, uri))
+    return orphans
+
+
+def collect(roots, grace=None, delete=False, workers=None, referenced=None):
+    """Yield URIs of unreferenced files found under storage ``roots``.
+
+    Every top-level directory of each root is scanned by a separate
+    worker thread.  Files modified or renamed within the last ``grace``
+    seconds are skipped.  A custom ``referenced`` set must hold
+    normalized URIs like the one built by :func:`referenced_uris`.
+
+    When ``delete`` is true the orphans are removed once the scan is
+    finished.  Records are read again before, and each file is checked
+    again just before it is removed, so files which were moved into a
+    root or reused by a record during the scan are kept.
+    """
+    roots = list(roots)
+    if referenced is None:
+        referenced = referenced_uris(prefixes=roots)
+    cutoff = None
+    if grace is not None:
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=grace)
+
+    tasks = []
+    for root in roots:
+        root_fs = opener.opendir(root)
+        tasks.append((root, root_fs, '/', False, referenced, cutoff))
+        for path in root_fs.listdir('/', absolute=True, dirs_only=True):
+            tasks.append((root, root_fs, path, True, referenced, cutoff))
+
+    orphans = []
+    pool = ThreadPool(workers)
+    try:
+        for found in pool.imap_unordered(_scan, tasks):
+            for orphan in found:
+                if delete:
+                    orphans.append(orphan)
+                else:
+                    yield orphan[2]
+    finally:
+        pool.terminate()
+
+    if orphans:
+        referenced = set(referenced) | referenced_uris(prefixes=roots)
+    for root_fs, filename, uri in orphans:
+        if normalize_uri(uri) in referenced or not root_fs.exists(filename):
+            continue
+        if cutoff is not None and _changed_since(root_fs, filename, cutoff):
+            continue
+        root_fs.remove(filename)
+        yield uri
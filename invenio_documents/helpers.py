@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Helpers for serving documents over HTTP."""
+
+from __future__ import absolute_import, print_function
+
+import mimetypes
+
+from flask import abort, current_app, request
+
+from .errors import ContentTooLargeError
+from .replication import preferred
+from .storage import parse_uri
+
+
+def send_document(document, mimetype=None, chunk_size=64 * 1024):
+    """Stream a document as a Flask response.
+
+    The response has a ``Content-Length`` header, uses the stored
+    checksum as ``ETag`` and honors conditional requests as well as a
+    single byte range.  Documents without a checksum get a weak ``ETag``
+    built from their size and modification time.  The file is streamed
+    in ``chunk_size`` chunks so memory usage does not depend on the file
+    size.
+    """
+    _fs, filename = parse_uri(preferred(document.replicas))
+    info = _fs.getinfo(filename)
+    size = info['size']
+    etag, weak = document.checksum, False
+    if not etag and info.get('modified_time'):
+        etag = '{0}-{1}'.format(size, info['modified_time'].isoformat())
+        weak = True
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(filename)[0] or \
+            'application/octet-stream'
+
+    response = current_app.response_class(
+        mimetype=mimetype, direct_passthrough=True
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    if etag:
+        response.set_etag(etag, weak=weak)
+        if request.if_none_match.contains_weak(etag):
+            response.status_code = 304
+            return response
+
+    start, end = 0, size
+    if request.range and len(request.range.ranges) == 1 and (
+        not request.if_range.etag or
+        (not weak and request.if_range.etag == etag)
+    ):
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            response.status_code = 416
+            response.headers['Content-Range'] = 'bytes */{0}'.format(size)
+            return response
+        start, end = byte_range
+        response.status_code = 206
+        response.headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(
+            start, end - 1, size
+        )
+
+    response.response = document.iter_content(chunk_size, start, end)
+    response.content_length = end - start
+    return response
+
+
+def receive_document(document, max_size=None):
+    """Stream body of the current request to a document.
+
+    The body is piped from the WSGI input to the storage without any
+    intermediate file.  Requests larger than ``max_size`` bytes (or
+    ``DOCUMENTS_INGEST_MAX_SIZE``) are aborted with ``413``.  Returns
+    the number of bytes written.
+    """
+    if max_size is None:
+        max_size = current_app.config['DOCUMENTS_INGEST_MAX_SIZE']
+    try:
+        return document.ingest(request.stream, max_size=max_size,
+                               content_length=request.content_length)
+    except ContentTooLargeError:
+        abort(413)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Streaming ingest of request bodies and iterators of chunks."""
+
+from __future__ import absolute_import, print_function
+
+import io
+
+from .errors import ContentTooLargeError, IncompleteContentError
+
+
+class ChunkReader(io.RawIOBase):
+    """Read a stream or an iterator of chunks enforcing a size limit.
+
+    At most ``content_length`` bytes are read from a stream such as
+    ``wsgi.input``.  :class:`~.errors.ContentTooLargeError` is raised as
+    soon as more than ``max_size`` bytes were read.
+    """
+
+    def __init__(self, source, max_size=None, content_length=None):
+        """Initialize reader of a file-like object or chunk iterator."""
+        super(ChunkReader, self).__init__()
+        self._read = getattr(source, 'read', None)
+        self._chunks = None if self._read is not None else iter(source)
+        self._buffer = b''
+        self.max_size = max_size
+        self.content_length = content_length
+        self.size = 0
+
+    def readable(self):
+        """Return ``True``."""
+        return True
+
+    def _next(self, size):
+        """Return at most ``size`` bytes of the source."""
+        if self._chunks is None:
+            return self._read(size)
+        data = self._buffer
+        while not data:
+            try:
+                data = next(self._chunks)
+            except StopIteration:
+                break
+        data, self._buffer = data[:size], data[size:]
+        return data
+
+    def readinto(self, buf):
+        """Read next chunk into ``buf``."""
+        size = len(buf)
+        if self.content_length is not None:
+            size = min(size, self.content_length - self.size)
+            if size <= 0:
+                return 0
+        data = self._next(size)
+        if not data and self.content_length is not None:
+            raise IncompleteContentError(
+                'Expected {0} bytes, got {1}.'.format(
+                    self.content_length, self.size
+                )
+            )
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise ContentTooLargeError(
+                'Content exceeds {0} bytes.'.format(self.max_size)
+            )
+        buf[:len(data)] = data
+        return len(data)
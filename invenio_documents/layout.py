@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Sharded directory layout for document files.
+
+Files are placed under ``<base>/<ab>/<cd>/<key>-<filename>`` where the
+directory names are prefixes of the SHA-1 hash of the key.  With the
+default depth of two levels and a width of two hexadecimal characters,
+each directory holds at most 256 entries before the files themselves.
+"""
+
+from __future__ import absolute_import, print_function
+
+import hashlib
+import posixpath
+import uuid
+from multiprocessing.pool import ThreadPool
+
+from flask import current_app
+from fs.opener import opener
+from invenio_db import db
+from invenio_records.api import Record
+
+from .api import Document, _move
+from .utils import is_store_object, is_under, iter_document_pointers, \
+    iter_records, join_uri, normalize_uri, uri_scheme
+
+
+def shard(key, depth=2, width=2):
+    """Return sharded directory path of ``key``."""
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return '/'.join(digest[i * width:(i + 1) * width] for i in range(depth))
+
+
+def allocate_uri(base, key=None, filename=None, depth=2, width=2):
+    """Return URI of a new file under ``base`` and create its directory."""
+    key = key or uuid.uuid4().hex
+    name = key if filename is None else '{0}-{1}'.format(key, filename)
+    directory = shard(key, depth=depth, width=width)
+    base_fs = opener.opendir(base, writeable=True, create_dir=True)
+    base_fs.makedir(directory, recursive=True, allow_recreate=True)
+    return join_uri(base, posixpath.join(directory, name))
+
+
+def allocate_document_uri(document, base=None):
+    """Return sharded URI for the document.
+
+    The key is derived from the record identifier and the pointer, so a
+    document is always allocated the same location.
+    """
+    config = current_app.config
+    record_id = getattr(document.record, 'id', None)
+    if record_id is None:
+        key = uuid.uuid4().hex
+    else:
+        key = hashlib.sha1('{0}{1}'.format(
+            record_id, document.pointer
+        ).encode('utf-8')).hexdigest()
+    replicas = document.replicas
+    filename = posixpath.basename(replicas[0]) if replicas else None
+    return allocate_uri(
+        base or config['DOCUMENTS_LAYOUT_BASE'], key=key, filename=filename,
+        depth=config['DOCUMENTS_LAYOUT_DEPTH'],
+        width=config['DOCUMENTS_LAYOUT_WIDTH'],
+    )
+
+
+def _needs_move(uri, base):
+    """Check if the file should be moved under ``base``.
+
+    Pack members, shared version objects and replicated documents, whose
+    replicas live on different backends, always stay in place.
+    """
+    if isinstance(uri, list):
+        return False
+    return not is_under(normalize_uri(uri), normalize_uri(base)) and \
+        uri_scheme(uri) != 'pack' and not is_store_object(uri)
+
+
+def _rebalance_record(task):
+    """Move all documents of one record into the sharded layout.
+
+    Files are moved by :meth:`~.api.Document.move`, which renames them
+    when they stay on one device.  If a move or the commit fails, the
+    session is rolled back and the moved files are moved back, so the
+    record and its files are left as they were.  Returns ``(record_id,
+    moved, error)``; after a failure ``moved`` lists the files which
+    could not be moved back.
+    """
+    app, base, record_id = task
+    with app.app_context():
+        moved = []
+        try:
+            record = Record.get_record(record_id)
+            for pointer, uri in list(iter_document_pointers(record)):
+                if not _needs_move(uri, base):
+                    continue
+                document = Document(record, pointer)
+                dst = allocate_document_uri(document, base)
+                document.move(dst)
+                moved.append((pointer, uri, dst))
+            record.commit()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            error = e
+            try:
+                while moved:
+                    _move(moved[-1][2], moved[-1][1])
+                    moved.pop()
+            except Exception as restore_error:
+                error = restore_error
+            return record_id, moved, error
+        return record_id, moved, None
+
+
+def rebalance(base=None, record_ids=None, workers=None, batch_size=100):
+    """Move documents of records into the sharded layout under ``base``.
+
+    Records are processed in parallel by ``workers`` threads, each with
+    its own application context and database session.  Yields
+    ``(record_id, [(pointer, old_uri, new_uri), ...], error)`` where
+    ``error`` is the exception which stopped the record; failures do not
+    abort the remaining records.
+    """
+    app = current_app._get_current_object()
+    base = base or app.config['DOCUMENTS_LAYOUT_BASE']
+    pool = ThreadPool(workers)
+    try:
+        batch = []
+        for record_id, data in iter_records(ids=record_ids):
+            if any(_needs_move(uri, base)
+                   for _, uri in iter_document_pointers(data)):
+                batch.append((app, base, record_id))
+            if len(batch) >= batch_size:
+                for result in pool.imap_unordered(_rebalance_record, batch):
+                    yield result
+                batch = []
+        for result in pool.imap_unordered(_rebalance_record, batch):
+            yield result
+    finally:
+        pool.terminate()
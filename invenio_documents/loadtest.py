@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Load generator replaying a mix of document operations.
+
+Every worker thread or process runs ``requests`` operations picked at
+random according to the weights of the mix.  Reads use a set of shared
+files while writes go to files owned by the worker, so workers never
+modify each other's files.  Documents are bound to plain dictionaries
+instead of stored records.
+"""
+
+from __future__ import absolute_import, print_function
+
+import math
+import random
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from functools import partial
+from io import BytesIO
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer
+
+from flask import current_app
+from fs.opener import opener
+
+from .api import Document
+from .utils import join_uri
+
+DEFAULT_MIX = {'open': 1, 'read': 4, 'copy': 1, 'move': 1, 'setcontents': 2}
+"""Default weights of operations."""
+
+OperationStats = namedtuple('OperationStats', (
+    'operation', 'count', 'errors', 'throughput', 'p50', 'p95', 'p99'
+))
+"""Throughput in operations per second and latency percentiles."""
+
+
+def percentile(values, q):
+    """Return the ``q``-th percentile of sorted ``values``."""
+    if not values:
+        return None
+    index = int(math.ceil(q / 100.0 * len(values))) - 1
+    return values[max(index, 0)]
+
+
+def serve_memory(host='127.0.0.1', port=0):
+    """Serve an in-memory filesystem over XML-RPC in a thread.
+
+    This is a local stand-in for remote storage.  Returns the server
+    and the ``rpc://`` URI of its root.
+    """
+    from fs.expose.xmlrpc import RPCFSServer
+    from fs.memoryfs import MemoryFS
+
+    server = RPCFSServer(MemoryFS(), (host, port), logRequests=False)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'rpc://{0}:{1}/'.format(*server.server_address[:2])
+
+
+class _Client(object):
+    """Run operations of one worker."""
+
+    def __init__(self, target, worker_id, shared, payload, seed):
+        self.target = target
+        self.record = {
+            'own': join_uri(target, 'worker-{0}/file'.format(worker_id)),
+            'copy': join_uri(target, 'worker-{0}/copy'.format(worker_id)),
+            'shared': shared,
+        }
+        self.payload = payload
+        self.random = random.Random(seed)
+
+    @property
+    def own(self):
+        return Document(self.record, '/own')
+
+    def shared(self):
+        index = self.random.randrange(len(self.record['shared']))
+        return Document(self.record, '/shared/{0}'.format(index))
+
+    def op_open(self):
+        self.shared().open('rb').close()
+
+    def op_read(self):
+        for _ in self.shared().iter_content():
+            pass
+
+    def op_copy(self):
+        self.own.copy(self.record['copy'])
+
+    def op_move(self):
+        uri = self.own.uri
+        self.own.move(uri[:-len('.moved')] if uri.endswith('.moved')
+                      else uri + '.moved')
+
+    def op_setcontents(self):
+        self.own.setcontents(BytesIO(self.payload))
+
+
+def _run_client(app, task):
+    """Run operations of one worker and return latencies and errors."""
+    target, worker_id, shared, payload, mix, requests, seed = task
+    with app.app_context():
+        client = _Client(target, worker_id, shared, payload, seed)
+        client.op_setcontents()
+        total = float(sum(mix.values()))
+        latencies = dict((name, []) for name in mix)
+        errors = dict((name, 0) for name in mix)
+        for _ in range(requests):
+            point = client.random.uniform(0, total)
+            for name, weight in sorted(mix.items()):
+                point -= weight
+                if point <= 0:
+                    break
+            start = default_timer()
+            try:
+                getattr(client, 'op_' + name)()
+            except Exception:
+                errors[name] += 1
+            else:
+                latencies[name].append(default_timer() - start)
+        return latencies, errors
+
+
+_process_app = None
+
+
+def _init_process(app):
+    """Keep the application of a forked worker process."""
+    global _process_app
+    _process_app = app
+    with app.app_context():
+        from invenio_db import db
+        db.engine.dispose()
+
+
+def _run_process(task):
+    """Run worker in a child process."""
+    return _run_client(_process_app, task)
+
+
+def run(target=None, mix=None, workers=4, requests=1000, files=10,
+        file_size=64 * 1024, processes=False, seed=None):
+    """Replay random operations and return :data:`OperationStats` list.
+
+    Files are created under ``target`` which defaults to a temporary
+    directory removed afterwards.  With ``processes`` the workers are
+    forked processes instead of threads.
+    """
+    app = current_app._get_current_object()
+    mix = dict(mix or DEFAULT_MIX)
+    unknown = set(mix) - set(DEFAULT_MIX)
+    if unknown:
+        raise ValueError('Unknown operations: {0}'.format(
+            ', '.join(sorted(unknown))
+        ))
+
+    temporary = None
+    if target is None:
+        target = temporary = tempfile.mkdtemp()
+    try:
+        target_fs = opener.opendir(target, writeable=True, create_dir=True)
+        target_fs.makedir('shared', allow_recreate=True)
+        for worker_id in range(workers):
+            target_fs.makedir('worker-{0}'.format(worker_id),
+                              allow_recreate=True)
+        payload = b'x' * file_size
+        shared = []
+        for index in range(files):
+            shared.append(join_uri(target, 'shared/{0}'.format(index)))
+            target_fs.setcontents('shared/{0}'.format(index), payload)
+
+        rng = random.Random(seed)
+        tasks = [(target, worker_id, shared, payload, mix, requests,
+                  rng.random()) for worker_id in range(workers)]
+        if processes:
+            pool = Pool(workers, initializer=_init_process, initargs=(app, ))
+            func = _run_process
+        else:
+            pool = ThreadPool(workers)
+            func = partial(_run_client, app)
+        start = default_timer()
+        try:
+            results = pool.map(func, tasks)
+        finally:
+            pool.terminate()
+        elapsed = default_timer() - start
+    finally:
+        if temporary is not None:
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    stats = []
+    for name in sorted(mix):
+        latencies = sorted(
+            value for result in results for value in result[0][name]
+        )
+        stats.append(OperationStats(
+            name, len(latencies), sum(result[1][name] for result in results),
+            len(latencies) / elapsed if elapsed else 0,
+            percentile(latencies, 50), percentile(latencies, 95),
+            percentile(latencies, 99),
+        ))
+    return stats
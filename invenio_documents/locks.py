@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Per-URI locks serializing writers while allowing concurrent readers.
+
+Locking is disabled unless ``DOCUMENTS_LOCK_MANAGER`` is set.  Locks of
+one operation are acquired in sorted URI order so two operations can
+not deadlock each other.  Locks are not reentrant: a thread holding an
+open document must not write to it.
+"""
+
+from __future__ import absolute_import, print_function
+
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from timeit import default_timer
+
+from flask import current_app, has_app_context
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class LockStats(object):
+    """Number of acquired locks and time spent waiting for them."""
+
+    def __init__(self):
+        """Initialize empty statistics."""
+        self._lock = threading.Lock()
+        self.acquired = {'read': 0, 'write': 0}
+        self.wait_time = {'read': 0.0, 'write': 0.0}
+        self.max_wait = {'read': 0.0, 'write': 0.0}
+
+    def observe(self, mode, elapsed):
+        """Record time spent acquiring a lock in ``mode``."""
+        with self._lock:
+            self.acquired[mode] += 1
+            self.wait_time[mode] += elapsed
+            self.max_wait[mode] = max(self.max_wait[mode], elapsed)
+
+    def as_dict(self):
+        """Return statistics keyed by lock mode."""
+        with self._lock:
+            return dict(
+                (mode, {
+                    'acquired': self.acquired[mode],
+                    'wait_time': self.wait_time[mode],
+                    'max_wait': self.max_wait[mode],
+                })
+                for mode in self.acquired
+            )
+
+
+class LockManager(object):
+    """Base class of lock managers.
+
+    Subclasses implement :meth:`acquire` and :meth:`release` of a single
+    URI lock, e.g. on top of a cluster-wide lock service.
+    """
+
+    def __init__(self):
+        """Initialize lock statistics."""
+        self.stats = LockStats()
+
+    def acquire(self, uri, exclusive):
+        """Block until the lock of ``uri`` is held and return a token."""
+        raise NotImplementedError()
+
+    def release(self, uri, exclusive, token):
+        """Release lock of ``uri`` acquired with ``token``."""
+        raise NotImplementedError()
+
+    def _release_all(self, held):
+        for uri, exclusive, token in reversed(held):
+            self.release(uri, exclusive, token)
+
+    def lock(self, read=(), write=()):
+        """Acquire shared locks of ``read`` and exclusive of ``write``.
+
+        Returns a callable releasing all the locks.
+        """
+        modes = dict((uri, False) for uri in read)
+        modes.update((uri, True) for uri in write)
+        start = default_timer()
+        held = []
+        try:
+            for uri in sorted(modes):
+                held.append((uri, modes[uri], self.acquire(uri, modes[uri])))
+        except Exception:
+            self._release_all(held)
+            raise
+        self.stats.observe('write' if write else 'read',
+                           default_timer() - start)
+        return lambda: self._release_all(held)
+
+    @contextmanager
+    def locked(self, read=(), write=()):
+        """Hold locks of URIs within the context."""
+        release = self.lock(read=read, write=write)
+        try:
+            yield
+        finally:
+            release()
+
+
+class _ReadWriteLock(object):
+    """Readers-writer lock preferring writers."""
+
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+        self.users = 0
+
+
+class LocalLockManager(LockManager):
+    """Locks shared by the threads of one process."""
+
+    def __init__(self):
+        """Initialize an empty lock table."""
+        super(LocalLockManager, self).__init__()
+        self._mutex = threading.Lock()
+        self._locks = {}
+
+    def acquire(self, uri, exclusive):
+        """Wait for the readers-writer lock of ``uri``."""
+        with self._mutex:
+            lock = self._locks.setdefault(uri, _ReadWriteLock())
+            lock.users += 1
+        with lock.condition:
+            if exclusive:
+                lock.waiting_writers += 1
+                while lock.writer or lock.readers:
+                    lock.condition.wait()
+                lock.waiting_writers -= 1
+                lock.writer = True
+            else:
+                while lock.writer or lock.waiting_writers:
+                    lock.condition.wait()
+                lock.readers += 1
+        return lock
+
+    def release(self, uri, exclusive, token):
+        """Release the lock and forget it when nobody uses it."""
+        with token.condition:
+            if exclusive:
+                token.writer = False
+            else:
+                token.readers -= 1
+            token.condition.notify_all()
+        with self._mutex:
+            token.users -= 1
+            if not token.users:
+                del self._locks[uri]
+
+
+class FileLockManager(LockManager):
+    """Locks shared by processes of one host using :func:`fcntl.flock`.
+
+    Lock files named by the SHA-1 hash of the URI are created in
+    ``directory`` and never removed.
+    """
+
+    def __init__(self, directory):
+        """Initialize manager keeping lock files in ``directory``."""
+        if fcntl is None:
+            raise RuntimeError('File locks are not supported here.')
+        super(FileLockManager, self).__init__()
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def acquire(self, uri, exclusive):
+        """Open the lock file of ``uri`` and lock it."""
+        path = os.path.join(self.directory, '{0}.lock'.format(
+            hashlib.sha1(uri.encode('utf-8')).hexdigest()
+        ))
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        except Exception:
+            os.close(fd)
+            raise
+        return fd
+
+    def release(self, uri, exclusive, token):
+        """Unlock and close the lock file."""
+        try:
+            fcntl.flock(token, fcntl.LOCK_UN)
+        finally:
+            os.close(token)
+
+
+class LockedFile(object):
+    """File object releasing its document locks when closed."""
+
+    def __init__(self, fileobj, release):
+        """Wrap ``fileobj`` calling ``release`` once on close."""
+        self._fileobj = fileobj
+        self._release = release
+
+    def __getattr__(self, name):
+        """Delegate attributes to the wrapped file."""
+        return getattr(self._fileobj, name)
+
+    def __iter__(self):
+        """Iterate over the wrapped file."""
+        return iter(self._fileobj)
+
+    def __enter__(self):
+        """Return the file."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close the file."""
+        self.close()
+
+    def close(self):
+        """Close the file and release the locks."""
+        try:
+            self._fileobj.close()
+        finally:
+            release, self._release = self._release, None
+            if release is not None:
+                release()
+
+
+class _Unlocked(object):
+    """Context doing nothing when locking is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_unlocked = _Unlocked()
+
+
+def get_manager():
+    """Return lock manager of the current application if enabled."""
+    if not has_app_context():
+        return None
+    ext = current_app.extensions.get('invenio-documents')
+    return getattr(ext, 'lock_manager', None)
+
+
+def acquire(read=(), write=()):
+    """Acquire locks and return callable releasing them or ``None``."""
+    manager = get_manager()
+    if manager is None:
+        return None
+    return manager.lock(read=read, write=write)
+
+
+def locked(read=(), write=()):
+    """Return context manager holding locks of URIs if enabled."""
+    manager = get_manager()
+    if manager is None:
+        return _unlocked
+    return manager.locked(read=read, write=write)
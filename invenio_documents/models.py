@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Database models of document URIs and cached file metadata."""
+
+from __future__ import absolute_import, print_function
+
+import mimetypes
+
+from invenio_db import db
+from sqlalchemy_utils.types import UUIDType
+
+from .storage import parse_uri
+from .utils import iter_replicas, iter_uris
+
+
+class DocumentURI(db.Model):
+    """Map a document URI to the record and pointer referencing it."""
+
+    __tablename__ = 'documents_uri'
+    __table_args__ = (
+        db.Index('ix_documents_uri_uri', 'uri', mysql_length=255),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    """Internal identifier of the index entry."""
+
+    uri = db.Column(db.Text, nullable=False)
+    """URI of the referenced file."""
+
+    record_id = db.Column(UUIDType, nullable=False, index=True)
+    """Identifier of the record referencing the file."""
+
+    pointer = db.Column(db.Text, nullable=False)
+    """JSON Pointer to the URI inside the record metadata."""
+
+    @classmethod
+    def lookup(cls, uri):
+        """Return index entries referencing given ``uri``."""
+        return cls.query.filter_by(uri=uri)
+
+    @classmethod
+    def set(cls, record_id, pointer, uri):
+        """Replace URIs indexed under the pointer.
+
+        The value can also be a list of replica URIs which are indexed
+        under ``<pointer>/<n>``.
+        """
+        children = pointer.replace('\\', '\\\\').replace(
+            '%', '\\%').replace('_', '\\_') + '/%'
+        with db.session.begin_nested():
+            cls.query.filter(
+                cls.record_id == record_id,
+                db.or_(cls.pointer == pointer,
+                       cls.pointer.like(children, escape='\\')),
+            ).delete(synchronize_session=False)
+            db.session.add_all(
+                cls(uri=value, record_id=record_id, pointer=path)
+                for path, value in iter_replicas(uri, pointer)
+            )
+
+    @classmethod
+    def delete_record(cls, record_id):
+        """Remove all index entries of a record."""
+        with db.session.begin_nested():
+            cls.query.filter_by(
+                record_id=record_id
+            ).delete(synchronize_session=False)
+
+    @classmethod
+    def index_record(cls, record_id, data):
+        """Replace index entries of a record with URIs found in ``data``."""
+        with db.session.begin_nested():
+            cls.query.filter_by(
+                record_id=record_id
+            ).delete(synchronize_session=False)
+            db.session.add_all(
+                cls(uri=uri, record_id=record_id, pointer=pointer)
+                for pointer, uri in iter_uris(data)
+            )
+
+
+class DocumentStat(db.Model):
+    """Cached metadata of a stored file.
+
+    Rows are refreshed when a document is written, copied or moved, so
+    reading them needs no storage round trip.
+    """
+
+    __tablename__ = 'documents_stat'
+    __table_args__ = (
+        db.Index('ix_documents_stat_uri', 'uri', unique=True,
+                 mysql_length=255),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    """Internal identifier of the cache entry."""
+
+    uri = db.Column(db.Text, nullable=False)
+    """URI of the file."""
+
+    size = db.Column(db.BigInteger, nullable=True)
+    """Size of the file in bytes."""
+
+    mtime = db.Column(db.DateTime, nullable=True)
+    """Last modification time reported by the storage."""
+
+    checksum = db.Column(db.String(255), nullable=True)
+    """Checksum of the content as ``<algorithm>:<hexdigest>``."""
+
+    mimetype = db.Column(db.String(255), nullable=True)
+    """MIME type guessed from the file name."""
+
+    @classmethod
+    def from_storage(cls, uri, checksum=None):
+        """Return new unsaved entry with metadata read from storage."""
+        _fs, filename = parse_uri(uri)
+        info = _fs.getinfo(filename)
+        return cls(
+            uri=uri, size=info.get('size'), mtime=info.get('modified_time'),
+            checksum=checksum, mimetype=mimetypes.guess_type(filename)[0],
+        )
+
+    @classmethod
+    def get(cls, uri):
+        """Return cached entry of ``uri`` or ``None``."""
+        return cls.query.filter_by(uri=uri).first()
+
+    @classmethod
+    def get_many(cls, uris):
+        """Return cached entries of ``uris`` keyed by URI in one query."""
+        return dict((stat.uri, stat)
+                    for stat in cls.query.filter(cls.uri.in_(list(uris))))
+
+    @classmethod
+    def refresh(cls, uri, checksum=None):
+        """Read metadata of ``uri`` from storage and store it."""
+        stat = cls.from_storage(uri, checksum=checksum)
+        with db.session.begin_nested():
+            cls.query.filter_by(uri=uri).delete(synchronize_session=False)
+            db.session.add(stat)
+        return stat
+
+    @classmethod
+    def rename(cls, old_uri, new_uri):
+        """Move cached entry of a renamed file."""
+        with db.session.begin_nested():
+            cls.query.filter_by(uri=new_uri).delete(
+                synchronize_session=False
+            )
+            cls.query.filter_by(uri=old_uri).update(
+                {'uri': new_uri}, synchronize_session=False
+            )
+
+    @classmethod
+    def delete(cls, uris):
+        """Remove cached entries of ``uris``."""
+        with db.session.begin_nested():
+            cls.query.filter(cls.uri.in_(list(uris))).delete(
+                synchronize_session=False
+            )
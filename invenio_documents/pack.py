@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Pack many small documents into large append-only container files.
+
+A container is a plain file holding the concatenated contents of its
+members and is accompanied by an ``<container>.index`` file with one
+JSON line (``name``, ``offset``, ``size``) per member.  Members are
+addressed by URIs of the form ``pack://<container-uri>#<member>`` and
+are read by seeking inside the container, without extracting them.
+Containers are read-only once written; members can be copied out but
+not moved or removed.
+"""
+
+from __future__ import absolute_import, print_function
+
+import io
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+import six
+from fs.base import FS
+from fs.errors import NoSysPathError, ResourceNotFoundError, \
+    UnsupportedError
+from fs.opener import opener
+
+from . import locks
+from .drivers import Driver
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def make_pack_uri(container_uri, name):
+    """Build URI of member ``name`` in the container."""
+    return 'pack://{0}#{1}'.format(container_uri, name)
+
+
+def parse_pack_uri(uri):
+    """Split pack URI into the container URI and the member name."""
+    container_uri, _, name = uri[len('pack://'):].rpartition('#')
+    return container_uri, name
+
+
+def read_index(container_uri):
+    """Return ``{name: (offset, size)}`` of members in the container.
+
+    Parsed indexes are cached per process and reloaded when the index
+    file grows.
+    """
+    _fs, path = opener.parse(container_uri + '.index')
+    size = _fs.getsize(path) if _fs.exists(path) else 0
+    with _indexes_lock:
+        cached = _indexes.get(container_uri)
+        if cached is not None and cached[0] == size:
+            return cached[1]
+
+    members = {}
+    if size:
+        for line in _fs.getcontents(path, 'rb').splitlines():
+            if line.strip():
+                entry = json.loads(line.decode('utf-8'))
+                members[entry['name']] = (entry['offset'], entry['size'])
+    with _indexes_lock:
+        _indexes[container_uri] = (size, members)
+    return members
+
+
+class MemberFile(io.RawIOBase):
+    """Read-only view of a byte range of the container file."""
+
+    def __init__(self, fileobj, offset, size):
+        """Initialize view of ``size`` bytes starting at ``offset``."""
+        super(MemberFile, self).__init__()
+        self._file = fileobj
+        self._offset = offset
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        """Member files are readable."""
+        return True
+
+    def seekable(self):
+        """Member files are seekable."""
+        return True
+
+    def tell(self):
+        """Return current position inside the member."""
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        """Change current position inside the member."""
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self._size
+        self._pos = max(0, pos)
+        return self._pos
+
+    def readinto(self, buf):
+        """Read member data into a pre-allocated buffer."""
+        size = min(len(buf), self._size - self._pos)
+        if size <= 0:
+            return 0
+        self._file.seek(self._offset + self._pos)
+        data = self._file.read(size)
+        buf[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def close(self):
+        """Close the underlying container file."""
+        if not self.closed:
+            self._file.close()
+        super(MemberFile, self).close()
+
+
+class PackFS(FS):
+    """Read-only filesystem exposing members of one container."""
+
+    _meta = {
+        'thread_safe': True,
+        'network': False,
+        'virtual': False,
+        'read_only': True,
+        'unicode_paths': True,
+        'case_insensitive_paths': False,
+        'atomic.setcontents': False,
+    }
+
+    def __init__(self, container_uri):
+        """Open container identified by ``container_uri``."""
+        super(PackFS, self).__init__(thread_synchronize=True)
+        self.container_uri = container_uri
+        self._fs, self._path = opener.parse(container_uri)
+        self._members = read_index(container_uri)
+
+    def __str__(self):
+        """Return human readable description."""
+        return '<PackFS: {0}>'.format(self.container_uri)
+
+    def _member(self, path):
+        """Return offset and size of a member."""
+        try:
+            return self._members[path.lstrip('/')]
+        except KeyError:
+            raise ResourceNotFoundError(path)
+
+    def open(self, path, mode='r', buffering=-1, encoding=None,
+             errors=None, newline=None, line_buffering=False, **kwargs):
+        """Open member for reading."""
+        if set(mode) & set('wa+'):
+            raise UnsupportedError('write to pack container')
+        offset, size = self._member(path)
+        fileobj = io.BufferedReader(MemberFile(
+            self._fs.open(self._path, 'rb'), offset, size
+        ))
+        if 'b' not in mode and six.PY3:
+            return io.TextIOWrapper(fileobj, encoding=encoding,
+                                    errors=errors, newline=newline)
+        return fileobj
+
+    def isfile(self, path):
+        """Check if member exists."""
+        return path.lstrip('/') in self._members
+
+    def isdir(self, path):
+        """Only the container root is a directory."""
+        return path in ('', '/', '.', './')
+
+    def listdir(self, path='./', wildcard=None, full=False, absolute=False,
+                dirs_only=False, files_only=False):
+        """List member names."""
+        if not self.isdir(path):
+            raise ResourceNotFoundError(path)
+        return self._listdir_helper(path, list(self._members), wildcard,
+                                    full, absolute, dirs_only, files_only)
+
+    def getinfo(self, path):
+        """Return member size."""
+        return {'size': self._member(path)[1]}
+
+    def makedir(self, path, recursive=False, allow_recreate=False):
+        """Containers have no directories."""
+        raise UnsupportedError('make directory in pack container')
+
+    def remove(self, path):
+        """Members can not be removed from an append-only container."""
+        raise UnsupportedError('remove from pack container')
+
+    def removedir(self, path, recursive=False, force=False):
+        """Containers have no directories."""
+        raise UnsupportedError('remove directory from pack container')
+
+    def rename(self, src, dst):
+        """Members can not be renamed."""
+        raise UnsupportedError('rename in pack container')
+
+
+class PackDriver(Driver):
+    """Driver of ``pack://`` URIs reading members of containers."""
+
+    supports_range = True
+
+    def parse(self, uri):
+        """Return container filesystem and member name."""
+        container_uri, name = parse_pack_uri(uri)
+        return PackFS(container_uri), name
+
+    def open_range(self, uri, start, end=None):
+        """Open only the requested range of a member."""
+        container_uri, name = parse_pack_uri(uri)
+        _fs, path = opener.parse(container_uri)
+        offset, size = PackFS(container_uri)._member(name)
+        end = size if end is None else min(end, size)
+        return io.BufferedReader(MemberFile(
+            _fs.open(path, 'rb'), offset + start, max(end - start, 0)
+        ))
+
+
+class PackWriter(object):
+    """Append files to a container and its index.
+
+    Appends are serialized between threads and, by an exclusive lock of
+    the container, between processes.  Local containers are locked with
+    :func:`fcntl.flock`, other ones with the configured document lock
+    manager.
+    """
+
+    def __init__(self, container_uri, chunk_size=64 * 1024):
+        """Prepare appending to ``container_uri``."""
+        self.container_uri = container_uri
+        self.chunk_size = chunk_size
+        self._fs, self._path = opener.parse(container_uri)
+        self._lock = threading.Lock()
+
+    def add(self, name, fileobj):
+        """Append content of ``fileobj`` as member ``name``.
+
+        Returns the URI of the new member.
+        """
+        if '#' in name:
+            raise ValueError('Member name must not contain "#".')
+        with self._lock, self._exclusive():
+            offset = self._fs.getsize(self._path) \
+                if self._fs.exists(self._path) else 0
+            size = 0
+            with self._fs.open(self._path, 'ab') as container:
+                for chunk in iter(lambda: fileobj.read(self.chunk_size),
+                                  b''):
+                    container.write(chunk)
+                    size += len(chunk)
+            line = json.dumps({'name': name, 'offset': offset, 'size': size})
+            with self._fs.open(self._path + '.index', 'ab') as index:
+                index.write((line + '\n').encode('utf-8'))
+        return make_pack_uri(self.container_uri, name)
+
+    @contextmanager
+    def _exclusive(self):
+        """Lock the container against writers in other processes."""
+        try:
+            path = self._fs.getsyspath(self._path)
+        except NoSysPathError:
+            path = None
+        if path is None or fcntl is None:
+            with locks.locked(write=(self.container_uri, )):
+                yield
+            return
+
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+
+def pack_documents(documents, container_uri, max_size=None):
+    """Append documents to a container and point them to their members.
+
+    Documents larger than ``max_size`` bytes are skipped.  Original files
+    are left in place.  Returns the list of packed documents.
+    """
+    from .storage import parse_uri
+
+    writer = PackWriter(container_uri)
+    packed = []
+    for document in documents:
+        if max_size is not None:
+            _fs, filename = parse_uri(document.replicas[0])
+            if _fs.getsize(filename) > max_size:
+                continue
+        with document.open('rb') as fp:
+            uri = writer.add(uuid.uuid4().hex, fp)
+        document.uri = uri
+        packed.append(document)
+    return packed
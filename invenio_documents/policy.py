@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Timeout, retry and circuit-breaker policies for storage backends.
+
+Policies are configured per URI scheme in
+:data:`~invenio_documents.config.DOCUMENTS_STORAGE_POLICIES`.  An
+operation touching several schemes uses the shortest timeout and the
+lowest number of retries of their policies and counts failures against
+the circuit breakers of all of them.  Only idempotent operations are
+retried; only connection and timeout errors count as backend failures.
+
+A timed-out call keeps running in the background and is never retried.
+Opening a file for reading is simply given up after the timeout.
+Transfers (copy, move and setcontents) read their source through a
+:class:`Watchdog` and are given up when no chunk was read for the
+timeout, so large but progressing transfers are not interrupted.  The
+abandoned transfer fails on its next read, so it cannot keep writing
+once locks are released.
+
+Still unprotected are reads from already opened files, renames,
+server-side copies and the final flush of a write blocked in the
+backend; they rely on the timeouts of the storage backend.
+"""
+
+from __future__ import absolute_import, print_function
+
+import random
+import threading
+import time
+
+from flask import current_app, has_app_context
+from fs.errors import OperationTimeoutError, RemoteConnectionError
+
+from .errors import CircuitOpenError, StorageTimeoutError
+from .utils import uri_scheme
+
+RETRYABLE_ERRORS = (
+    OperationTimeoutError, RemoteConnectionError, StorageTimeoutError,
+)
+"""Errors considered transient backend failures."""
+
+_lock = threading.Lock()
+_breakers = {}
+
+
+class CircuitBreaker(object):
+    """Fail fast after ``threshold`` consecutive backend failures.
+
+    Once open, calls are rejected for ``reset_timeout`` seconds after
+    which one trial call is let through.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        """Initialize a closed breaker."""
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        """Check if calls are currently rejected."""
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if time.time() - self.opened_at >= self.reset_timeout:
+                self.opened_at = None
+                self.failures = self.threshold - 1
+                return False
+            return True
+
+    def success(self):
+        """Close the breaker after a successful call."""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        """Record a failed call and open the breaker if needed."""
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.time()
+
+
+def get_policy(scheme):
+    """Return configured policy of the scheme."""
+    if not has_app_context():
+        return None
+    return current_app.config.get('DOCUMENTS_STORAGE_POLICIES', {}).get(
+        scheme
+    )
+
+
+def get_breaker(scheme, policy):
+    """Return process-wide circuit breaker of the scheme."""
+    threshold = policy.get('failure_threshold')
+    if not threshold:
+        return None
+    key = (scheme, threshold, policy.get('reset_timeout', 60))
+    with _lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(threshold, key[2])
+        return _breakers[key]
+
+
+class Watchdog(object):
+    """Progress of a transfer observed through the files it reads."""
+
+    def __init__(self):
+        """Initialize watchdog of a transfer starting now."""
+        self.progress = time.time()
+        self.abandoned = False
+
+    def wrap(self, fileobj):
+        """Return ``fileobj`` reporting progress to the watchdog."""
+        return WatchedFile(fileobj, self)
+
+
+class WatchedFile(object):
+    """File-like wrapper recording when data was last read."""
+
+    def __init__(self, fileobj, watchdog):
+        """Wrap ``fileobj`` observed by ``watchdog``."""
+        self._file = fileobj
+        self._watchdog = watchdog
+
+    def _check(self):
+        """Refuse to continue a transfer which was given up."""
+        if self._watchdog.abandoned:
+            raise StorageTimeoutError('Transfer was abandoned.')
+
+    def read(self, *args):
+        """Read data and record the progress."""
+        self._check()
+        data = self._file.read(*args)
+        self._check()
+        self._watchdog.progress = time.time()
+        return data
+
+    def __getattr__(self, name):
+        """Proxy other attributes to the wrapped file."""
+        return getattr(self._file, name)
+
+
+def _policies(uris):
+    """Return configured policies keyed by the schemes of ``uris``."""
+    policies = {}
+    for scheme in set(uri_scheme(uri) for uri in uris):
+        policy = get_policy(scheme)
+        if policy:
+            policies[scheme] = policy
+    return policies
+
+
+def get_timeout(uris):
+    """Return the shortest timeout configured for ``uris`` if any."""
+    timeouts = [p['timeout'] for p in _policies(uris).values()
+                if p.get('timeout')]
+    return min(timeouts) if timeouts else None
+
+
+def get_watchdog(uris):
+    """Return :class:`Watchdog` for a transfer if ``uris`` have a timeout."""
+    return Watchdog() if get_timeout(uris) is not None else None
+
+
+def with_timeout(func, timeout, watchdog=None):
+    """Call ``func`` and give up waiting after ``timeout`` seconds.
+
+    With a ``watchdog`` the timeout counts from the last progress of the
+    transfer, which is abandoned when it expires.  The call keeps
+    running in a daemon thread when it times out.
+    """
+    if timeout is None:
+        return func()
+    outcome = {}
+
+    def target():
+        try:
+            outcome['result'] = func()
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    deadline = time.time() + timeout
+    while True:
+        thread.join(max(0, deadline - time.time()))
+        if not thread.is_alive():
+            break
+        if watchdog is not None and \
+                watchdog.progress + timeout > time.time():
+            deadline = watchdog.progress + timeout
+            continue
+        if watchdog is not None:
+            watchdog.abandoned = True
+        raise StorageTimeoutError(timeout)
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome.get('result')
+
+
+def call(uris, func, idempotent=False, read_only=False, watchdog=None):
+    """Call storage operation on ``uris`` according to their policies.
+
+    Idempotent operations are retried after transient errors.
+    ``read_only`` operations are given up after the timeout, transfers
+    observed by ``watchdog`` once they stopped progressing for it.
+    """
+    policies = _policies(uris)
+    if not policies:
+        return func()
+
+    breakers = [b for b in (get_breaker(s, p) for s, p in policies.items())
+                if b is not None]
+    timeout = get_timeout(uris) \
+        if read_only or watchdog is not None else None
+    retries = min(p.get('retries', 0) for p in policies.values()) \
+        if idempotent else 0
+    delay = max(p.get('backoff', 0.1) for p in policies.values())
+    max_delay = max(p.get('max_backoff', 30) for p in policies.values())
+
+    for attempt in range(retries + 1):
+        if any(breaker.is_open for breaker in breakers):
+            raise CircuitOpenError(', '.join(sorted(policies)))
+        try:
+            result = with_timeout(func, timeout, watchdog)
+        except RETRYABLE_ERRORS as e:
+            for breaker in breakers:
+                breaker.failure()
+            if attempt == retries or isinstance(e, StorageTimeoutError):
+                raise
+            time.sleep(random.uniform(0, min(delay * 2 ** attempt,
+                                             max_delay)))
+        else:
+            for breaker in breakers:
+                breaker.success()
+            return result
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Per-phase timing of document operations.
+
+Storage operations are wrapped in named phases.  Phases are no-ops
+unless a :class:`Profiler` has been activated, e.g. by the ``--profile``
+option of the ``documents`` command group.  Time spent in a nested
+phase is not counted in the enclosing one.
+"""
+
+from __future__ import absolute_import, print_function
+
+import cProfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+
+_active = None
+
+
+class _NullPhase(object):
+    """Phase doing nothing when profiling is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_phase = _NullPhase()
+
+
+class Profiler(object):
+    """Collect exclusive wall time and number of calls per phase."""
+
+    def __init__(self, stats_file=None):
+        """Initialize profiler optionally running :mod:`cProfile`."""
+        self.stats_file = stats_file
+        self.timings = OrderedDict()
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profile = cProfile.Profile() if stats_file else None
+        self._start = self._end = None
+
+    def _add(self, name, elapsed, calls=0):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0) + elapsed
+            self.calls[name] = self.calls.get(name, 0) + calls
+
+    @contextmanager
+    def phase(self, name):
+        """Measure time spent in phase ``name``."""
+        stack = self._local.__dict__.setdefault('stack', [])
+        now = default_timer()
+        if stack:
+            self._add(stack[-1][0], now - stack[-1][1])
+        stack.append([name, now])
+        try:
+            yield
+        finally:
+            name, start = stack.pop()
+            now = default_timer()
+            self._add(name, now - start, calls=1)
+            if stack:
+                stack[-1][1] = now
+
+    def start(self):
+        """Start measuring total time and :mod:`cProfile` if enabled."""
+        self._start = default_timer()
+        if self._profile is not None:
+            self._profile.enable()
+
+    def stop(self):
+        """Stop measuring and dump :mod:`cProfile` statistics."""
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.stats_file)
+        self._end = default_timer()
+
+    @property
+    def total(self):
+        """Return total wall time in seconds."""
+        return (self._end or default_timer()) - self._start
+
+    def report(self):
+        """Yield report lines with time spent in each phase."""
+        total = self.total
+        other = total - sum(self.timings.values())
+        rows = list(self.timings.items()) + [('other', other)]
+        yield '{0:<20} {1:>8} {2:>10} {3:>7}'.format(
+            'phase', 'calls', 'seconds', '%'
+        )
+        for name, elapsed in rows:
+            yield '{0:<20} {1:>8} {2:>10.4f} {3:>6.1f}%'.format(
+                name, self.calls.get(name, ''), elapsed,
+                100.0 * elapsed / total if total else 0
+            )
+        yield '{0:<20} {1:>8} {2:>10.4f}'.format('total', '', total)
+
+
+def activate(profiler):
+    """Make ``profiler`` record all phases and start it."""
+    global _active
+    _active = profiler
+    profiler.start()
+
+
+def deactivate():
+    """Stop and return the active profiler."""
+    global _active
+    profiler, _active = _active, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+def phase(name):
+    """Return context manager measuring phase ``name`` if profiling."""
+    if _active is None:
+        return _null_phase
+    return _active.phase(name)
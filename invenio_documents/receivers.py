@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Signal receivers keeping indexes and caches up to date."""
+
+from __future__ import absolute_import, print_function
+
+from flask import current_app, has_app_context
+
+from .models import DocumentURI
+from .utils import as_replicas
+
+
+def _get_record(sender, record):
+    """Return the record from both old and new style record signals."""
+    return sender if record is None else record
+
+
+def _extension():
+    """Return the extension of the current application if any.
+
+    Receivers are connected to process-wide signals, which are also sent
+    outside of an application context or by applications without the
+    extension.
+    """
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('invenio-documents')
+
+
+def _index_enabled():
+    """Check if the current application maintains the URI index."""
+    return _extension() is not None and \
+        current_app.config['DOCUMENTS_URI_INDEX']
+
+
+def index_document_uri(sender, old_uri=None, new_uri=None, **kwargs):
+    """Update the index entry of a document pointer."""
+    record_id = getattr(sender.record, 'id', None)
+    if record_id is not None and _index_enabled():
+        DocumentURI.set(record_id, sender.pointer, new_uri)
+
+
+def index_record_uris(sender, record=None, **kwargs):
+    """Reindex all URIs of an inserted or updated record."""
+    record = _get_record(sender, record)
+    if record.id is not None and _index_enabled():
+        DocumentURI.index_record(record.id, record)
+
+
+def delete_record_uris(sender, record=None, **kwargs):
+    """Remove index entries of a deleted record."""
+    record = _get_record(sender, record)
+    if record.id is not None and _index_enabled():
+        DocumentURI.delete_record(record.id)
+
+
+def _invalidate_derivatives(uris):
+    """Drop cached derivatives of ``uris`` if the cache is set up."""
+    ext = _extension()
+    if ext is not None and ext.derivatives is not None:
+        for uri in uris:
+            ext.derivatives.invalidate(uri)
+
+
+def invalidate_moved_derivatives(sender, old_uri=None, **kwargs):
+    """Drop cached derivatives of the previous document URI."""
+    _invalidate_derivatives(as_replicas(old_uri))
+
+
+def invalidate_changed_derivatives(sender, **kwargs):
+    """Drop cached derivatives of a document with new content."""
+    _invalidate_derivatives(sender.replicas)
+
+
+def invalidate_content_cache(sender, old_uri=None, new_uri=None, **kwargs):
+    """Drop cached content of a changed, moved or removed document.
+
+    On URI changes both the previous and the new files are dropped, as
+    the new one may have been cached before it was overwritten.
+    """
+    cache = getattr(_extension(), 'content_cache', None)
+    if cache is not None:
+        if old_uri is None and new_uri is None:
+            uris = sender.replicas
+        else:
+            uris = as_replicas(old_uri) + as_replicas(new_uri)
+        for uri in uris:
+            cache.invalidate(uri)
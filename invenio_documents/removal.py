@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Bulk removal of documents from many records.
+
+References are cleared and records committed in batches first, then the
+files are removed concurrently, so a failing storage never leaves a
+record pointing to a missing file.  Files which could not be removed
+are reported and later found by the garbage collector.
+"""
+
+from __future__ import absolute_import, print_function
+
+from collections import OrderedDict, namedtuple
+from multiprocessing.pool import ThreadPool
+
+from invenio_db import db
+from invenio_records.api import Record
+
+from . import locks, policy
+from .api import Document, _forget
+from .drivers import get_driver
+from .storage import parse_uri
+from .utils import is_store_object, is_version_pointer, \
+    iter_document_pointers
+
+RemovalResult = namedtuple(
+    'RemovalResult', ('record_id', 'pointer', 'uri', 'error')
+)
+"""Result of removing a single file or document reference."""
+
+
+def _remove_file(uri):
+    """Remove one file and return list of ``(uri, error)``."""
+    try:
+        _fs, filename = parse_uri(uri)
+        with locks.locked(write=(uri, )):
+            policy.call((uri, ), lambda: _fs.remove(filename))
+    except Exception as e:
+        return [(uri, e)]
+    return [(uri, None)]
+
+
+def _remove_batch(task):
+    """Remove many files with one request of their driver."""
+    driver, uris = task
+    try:
+        with locks.locked(write=uris):
+            return policy.call(uris, lambda: driver.remove_many(uris))
+    except Exception as e:
+        return [(uri, e) for uri in uris]
+
+
+def _run(task):
+    """Dispatch task of the removal pool."""
+    func, args = task
+    return func(args)
+
+
+def remove_files(uris, workers=None, batch_size=1000):
+    """Remove files concurrently and yield ``(uri, error)``.
+
+    Files of drivers supporting batch deletes are removed in requests of
+    at most ``batch_size`` files, other files one by one.  ``error`` is
+    ``None`` for removed files, whose cached content and metadata are
+    dropped.
+    """
+    tasks = []
+    batches = OrderedDict()
+    for uri in uris:
+        driver = get_driver(uri)
+        if driver.supports_batch_delete:
+            batches.setdefault(driver, []).append(uri)
+        else:
+            tasks.append((_remove_file, uri))
+    for driver, items in batches.items():
+        for i in range(0, len(items), batch_size):
+            tasks.append((_remove_batch, (driver, items[i:i + batch_size])))
+
+    pool = ThreadPool(workers)
+    try:
+        for results in pool.imap_unordered(_run, tasks):
+            for uri, error in results:
+                if error is None:
+                    _forget(uri)
+                yield uri, error
+    finally:
+        pool.terminate()
+
+
+def _clear_references(items):
+    """Clear URIs of documents and return results of cleared files."""
+    pointers = OrderedDict()
+    for record_id, pointer in items:
+        pointers.setdefault(record_id, []).append(pointer)
+
+    results = []
+    for record_id, record_pointers in pointers.items():
+        cleared = []
+        try:
+            with db.session.begin_nested():
+                record = Record.get_record(record_id)
+                if None in record_pointers:
+                    record_pointers = [
+                        p for p, _ in iter_document_pointers(record)
+                        if not is_version_pointer(p)
+                    ]
+                for pointer in record_pointers:
+                    document = Document(record, pointer)
+                    cleared.extend(
+                        (pointer, uri) for uri in document.replicas
+                    )
+                    document.remove()
+                record.commit()
+        except Exception as e:
+            results.append(RemovalResult(record_id, None, None, e))
+            continue
+        results.extend(RemovalResult(record_id, pointer, uri, None)
+                       for pointer, uri in cleared)
+    db.session.commit()
+    return results
+
+
+def bulk_remove(items, force=False, workers=None, batch_size=100):
+    """Remove documents given as ``(record_id, pointer)`` pairs.
+
+    A ``None`` pointer removes all documents of the record.  Records are
+    committed every ``batch_size`` records and with ``force`` the files
+    of each batch are then removed by ``workers`` threads, except for
+    objects of ``DOCUMENTS_VERSIONS_STORE`` which may still be shared
+    and are left to the garbage collector.  Yields a
+    :data:`RemovalResult` for every file, failures do not abort the
+    remaining removals.
+    """
+    items = iter(items)
+    while True:
+        chunk, records = [], set()
+        for record_id, pointer in items:
+            chunk.append((record_id, pointer))
+            records.add(record_id)
+            if len(records) >= batch_size:
+                break
+        if not chunk:
+            return
+
+        results = _clear_references(chunk)
+        if not force:
+            for result in results:
+                yield result
+            continue
+
+        cleared = OrderedDict()
+        for result in results:
+            if result.error is None and not is_store_object(result.uri):
+                cleared[result.uri] = result
+            else:
+                yield result
+        for uri, error in remove_files(cleared, workers=workers):
+            yield cleared[uri]._replace(error=error)
+        db.session.commit()
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Replicated documents stored on several backends.
+
+A replicated document stores a list of replica URIs under its pointer.
+Writes read the source once and fan the chunks out to temporary files
+next to all replicas concurrently, which replace the replicas only once
+the whole source was read.  Reads go to the replica with the lowest
+observed open latency among healthy backends and fall back to the others
+on error.
+"""
+
+from __future__ import absolute_import, print_function
+
+import threading
+import time
+import uuid
+
+from flask import current_app, has_app_context
+from six.moves import queue
+
+from . import policy
+from .errors import ReplicationError, StorageTimeoutError
+from .storage import parse_uri
+from .utils import uri_scheme
+
+
+def backend_key(uri):
+    """Return key identifying the backend serving ``uri``.
+
+    The longest matching prefix from
+    :data:`~invenio_documents.config.DOCUMENTS_REPLICA_BACKENDS` is used
+    if any, otherwise remote URIs are grouped by scheme and host.
+    """
+    if has_app_context():
+        prefixes = [prefix for prefix
+                    in current_app.config['DOCUMENTS_REPLICA_BACKENDS']
+                    if uri.startswith(prefix)]
+        if prefixes:
+            return max(prefixes, key=len)
+    if uri_scheme(uri) == 'file':
+        return 'file'
+    scheme, rest = uri.split('://', 1)
+    return scheme + '://' + rest.split('/', 1)[0]
+
+
+class LatencyTracker(object):
+    """Exponentially weighted open latency and health of backends."""
+
+    def __init__(self, alpha=0.2, penalty=30):
+        """Initialize tracker.
+
+        Backends which failed are avoided for ``penalty`` seconds.
+        """
+        self.alpha = alpha
+        self.penalty = penalty
+        self.latencies = {}
+        self.failed = {}
+        self._lock = threading.Lock()
+
+    def observe(self, uri, latency):
+        """Record a successful call."""
+        key = backend_key(uri)
+        with self._lock:
+            previous = self.latencies.get(key)
+            self.latencies[key] = latency if previous is None else \
+                self.alpha * latency + (1 - self.alpha) * previous
+            self.failed.pop(key, None)
+
+    def failure(self, uri):
+        """Record a failed call."""
+        with self._lock:
+            self.failed[backend_key(uri)] = time.time()
+
+    def order(self, uris):
+        """Sort URIs from the most to the least preferred replica."""
+        now = time.time()
+        with self._lock:
+            def rank(uri):
+                key = backend_key(uri)
+                failed = now - self.failed.get(key, 0) < self.penalty
+                return failed, self.latencies.get(key, 0)
+            return sorted(uris, key=rank)
+
+
+tracker = LatencyTracker()
+"""Process-wide latency tracker used to pick replicas."""
+
+
+def preferred(uris):
+    """Return the preferred replica."""
+    return uris[0] if len(uris) == 1 else tracker.order(uris)[0]
+
+
+def open_replica(uris, mode='rb', **kwargs):
+    """Open the fastest healthy replica falling back to the others."""
+    if set(mode) & set('wa+'):
+        raise ValueError('Replicated documents are written by setcontents.')
+    error = None
+    for uri in tracker.order(uris):
+        _fs, filename = parse_uri(uri)
+        start = time.time()
+        try:
+            fileobj = policy.call((uri, ), lambda: _fs.open(
+                filename, mode=mode, **kwargs
+            ), idempotent=True, read_only=True)
+        except Exception as e:
+            tracker.failure(uri)
+            error = e
+            continue
+        tracker.observe(uri, time.time() - start)
+        return fileobj
+    raise error
+
+
+_ABORT = object()
+"""Queue marker telling replica writers that the source failed."""
+
+
+class _QueueReader(object):
+    """File-like object reading chunks from a queue."""
+
+    def __init__(self, chunks):
+        """Read from ``chunks`` until ``None`` is received."""
+        self.chunks = chunks
+        self.done = False
+        self.aborted = False
+
+    def read(self, size=-1):
+        """Return next chunk or empty bytes at the end.
+
+        Raises :class:`IOError` when the source could not be read to
+        its end, so the replica is never completed with partial data.
+        """
+        if self.aborted:
+            raise IOError('Reading the source of the replica failed.')
+        if self.done:
+            return b''
+        chunk = self.chunks.get()
+        if chunk is _ABORT:
+            self.aborted = True
+            return self.read()
+        if chunk is None:
+            self.done = True
+            return b''
+        return chunk
+
+
+def _remove_quietly(_fs, filename):
+    """Remove an incomplete temporary file ignoring errors."""
+    try:
+        if _fs.exists(filename):
+            _fs.remove(filename)
+    except Exception:
+        pass
+
+
+def _write_replica(uri, _fs, temporary, reader, errors, chunk_size):
+    """Write chunks from ``reader`` to a temporary file of a replica."""
+    try:
+        _fs.setcontents(temporary, reader, chunk_size=chunk_size)
+    except Exception as e:
+        if reader.aborted:
+            return
+        errors[uri] = e
+        tracker.failure(uri)
+        try:
+            while reader.read():
+                pass  # keep consuming so the other replicas are not blocked
+        except IOError:
+            pass
+
+
+def write_replicas(uris, source, chunk_size=64 * 1024, buffer_size=8,
+                   timeout=None):
+    """Write ``source`` to all replicas reading it only once.
+
+    Every replica is written by its own thread from a queue of at most
+    ``buffer_size`` chunks to a temporary file next to it, which is
+    renamed over the replica once the whole source has been read.  If
+    reading the source fails, no replica is changed and the error is
+    raised.  A replica which did not accept a chunk or finish within
+    ``timeout`` seconds is given up.  Raises :class:`ReplicationError`
+    if writing to any replica failed; the other replicas hold the new
+    content.
+    """
+    errors = {}
+    targets = []
+    for uri in uris:
+        _fs, filename = parse_uri(uri)
+        targets.append((_fs, filename, '{0}.replica-{1}'.format(
+            filename, uuid.uuid4().hex
+        )))
+    readers = [_QueueReader(queue.Queue(buffer_size)) for _ in uris]
+    threads = [
+        threading.Thread(target=_write_replica, args=(
+            uri, _fs, temporary, reader, errors, chunk_size
+        ))
+        for uri, (_fs, _, temporary), reader in zip(uris, targets, readers)
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    def give_up(uri, reader):
+        reader.aborted = True
+        errors[uri] = StorageTimeoutError(timeout)
+        tracker.failure(uri)
+
+    complete = False
+    try:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            if not chunk:
+                break
+            for uri, reader in zip(uris, readers):
+                if reader.aborted:
+                    continue
+                try:
+                    reader.chunks.put(chunk, timeout=timeout)
+                except queue.Full:
+                    give_up(uri, reader)
+        complete = True
+    finally:
+        for reader in readers:
+            if not reader.aborted:
+                reader.chunks.put(None if complete else _ABORT)
+        for uri, reader, thread in zip(uris, readers, threads):
+            thread.join(timeout)
+            if thread.is_alive():
+                give_up(uri, reader)
+        if not complete:
+            for _fs, _, temporary in targets:
+                _remove_quietly(_fs, temporary)
+
+    for uri, (_fs, filename, temporary) in zip(uris, targets):
+        if uri not in errors:
+            try:
+                _fs.move(temporary, filename, overwrite=True)
+            except Exception as e:
+                errors[uri] = e
+                tracker.failure(uri)
+        if uri in errors:
+            _remove_quietly(_fs, temporary)
+    if errors:
+        raise ReplicationError(errors)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Signals sent by document operations."""
+
+from __future__ import absolute_import, print_function
+
+from blinker import Namespace
+
+_signals = Namespace()
+
+document_uri_changed = _signals.signal('document-uri-changed')
+"""Signal sent after the URI stored under a document pointer changed.
+
+Sender is the document.  Keyword arguments ``old_uri`` and ``new_uri``
+hold the previous and the current value; ``new_uri`` is ``None`` when
+the reference was removed.
+
+Example subscriber:
+
+.. code-block:: python
+
+    def listener(sender, old_uri=None, new_uri=None, **kwargs):
+        ...
+"""
+
+document_before_content_set = _signals.signal('document-before-content-set')
+"""Signal sent before the content of a document is replaced.
+
+Sender is the document.
+"""
+
+document_after_content_set = _signals.signal('document-after-content-set')
+"""Signal sent after the content of a document has been replaced.
+
+Sender is the document.
+"""
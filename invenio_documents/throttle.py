@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Bandwidth and concurrency limits for document transfers.
+
+Limits are configured per URI scheme using
+:data:`~invenio_documents.config.DOCUMENTS_BANDWIDTH_LIMITS` and
+:data:`~invenio_documents.config.DOCUMENTS_CONCURRENCY_LIMITS`.  Token
+buckets and semaphores are shared by all threads of a process.
+"""
+
+from __future__ import absolute_import, print_function
+
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, has_app_context
+
+from .utils import uri_scheme
+
+_lock = threading.Lock()
+_buckets = {}
+_semaphores = {}
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket refilled at ``rate`` tokens per second."""
+
+    def __init__(self, rate, capacity=None):
+        """Initialize a full bucket."""
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.timestamp = time.time()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        """Block until ``amount`` tokens have been taken from the bucket."""
+        while amount > 0:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.timestamp) * self.rate
+                )
+                self.timestamp = now
+                needed = min(amount, self.capacity)
+                if self.tokens >= needed:
+                    self.tokens -= needed
+                    amount -= needed
+                    continue
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ThrottledFile(object):
+    """File-like wrapper consuming tokens for every byte read."""
+
+    def __init__(self, fileobj, buckets):
+        """Wrap ``fileobj`` and throttle it by all ``buckets``."""
+        self._file = fileobj
+        self._buckets = buckets
+
+    def read(self, *args):
+        """Read data and wait until the bandwidth allows it."""
+        data = self._file.read(*args)
+        for bucket in self._buckets:
+            bucket.consume(len(data))
+        return data
+
+    def __getattr__(self, name):
+        """Proxy other attributes to the wrapped file."""
+        return getattr(self._file, name)
+
+
+def _get_limit(name, scheme):
+    """Return configured limit for the scheme."""
+    if not has_app_context():
+        return None
+    return current_app.config.get(name, {}).get(scheme)
+
+
+def get_bucket(scheme):
+    """Return process-wide token bucket of the scheme if limited."""
+    rate = _get_limit('DOCUMENTS_BANDWIDTH_LIMITS', scheme)
+    if not rate:
+        return None
+    with _lock:
+        key = (scheme, rate)
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(rate)
+        return _buckets[key]
+
+
+def get_semaphore(scheme):
+    """Return process-wide semaphore of the scheme if limited."""
+    limit = _get_limit('DOCUMENTS_CONCURRENCY_LIMITS', scheme)
+    if not limit:
+        return None
+    with _lock:
+        key = (scheme, limit)
+        if key not in _semaphores:
+            _semaphores[key] = threading.BoundedSemaphore(limit)
+        return _semaphores[key]
+
+
+@contextmanager
+def transfer(*uris):
+    """Reserve a transfer slot for all schemes of ``uris``.
+
+    Yields a function wrapping a readable file in :class:`ThrottledFile`
+    or ``None`` if no bandwidth limit applies.
+    """
+    schemes = sorted(set(uri_scheme(uri) for uri in uris))
+    semaphores = [s for s in map(get_semaphore, schemes) if s is not None]
+    buckets = [b for b in map(get_bucket, schemes) if b is not None]
+
+    for semaphore in semaphores:
+        semaphore.acquire()
+    try:
+        if buckets:
+            yield lambda fileobj: ThrottledFile(fileobj, buckets)
+        else:
+            yield None
+    finally:
+        for semaphore in reversed(semaphores):
+            semaphore.release()
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Helpers for finding document URIs stored in record metadata."""
+
+from __future__ import absolute_import, print_function
+
+import os
+import re
+from fnmatch import fnmatchcase
+
+import six
+from flask import current_app, has_app_context
+from invenio_db import db
+from invenio_records.models import RecordMetadata
+
+from . import config
+
+NON_STORAGE_SCHEMES = ('http', 'https')
+"""URI schemes which never reference managed storage."""
+
+
+def is_uri(value):
+    """Check if ``value`` can reference a stored document."""
+    return (isinstance(value, six.string_types) and bool(value) and
+            uri_scheme(value) not in NON_STORAGE_SCHEMES)
+
+
+_VERSION_POINTER_RE = re.compile(r'/versions/\d+/uri$')
+
+
+def _config(name):
+    """Return setting of the current application or its default."""
+    if has_app_context():
+        return current_app.config[name]
+    return getattr(config, name)
+
+
+def document_patterns():
+    """Return pointer patterns of fields holding document URIs."""
+    return _config('DOCUMENTS_URI_POINTERS')
+
+
+def is_document_pointer(pointer, patterns=None):
+    """Check if ``pointer`` matches one of the document patterns."""
+    if patterns is None:
+        patterns = document_patterns()
+    return any(fnmatchcase(pointer, p) for p in patterns)
+
+
+def is_version_pointer(pointer):
+    """Check if ``pointer`` is an entry of a list of document versions."""
+    return bool(_VERSION_POINTER_RE.search(pointer))
+
+
+def is_store_object(uri):
+    """Check if ``uri`` is an object of ``DOCUMENTS_VERSIONS_STORE``.
+
+    Such objects are content-addressed and shared between versions and
+    documents, so they are only ever removed by the garbage collector.
+    """
+    store = _config('DOCUMENTS_VERSIONS_STORE')
+    return bool(store) and is_under(normalize_uri(uri), normalize_uri(store))
+
+
+def escape_pointer_part(part):
+    """Escape a single JSON Pointer reference token."""
+    return six.text_type(part).replace('~', '~0').replace('/', '~1')
+
+
+def iter_document_pointers(data, patterns=None, pointer=''):
+    """Yield ``(pointer, value)`` of document fields found in ``data``.
+
+    Only fields whose pointer matches one of ``patterns`` (defaults to
+    ``DOCUMENTS_URI_POINTERS``) are documents; the value is either a URI
+    or a list of replica URIs.
+    """
+    if patterns is None:
+        patterns = document_patterns()
+    if pointer and is_document_pointer(pointer, patterns):
+        if is_uri(data) or isinstance(data, list):
+            yield pointer, data
+            return
+
+    if isinstance(data, dict):
+        items = six.iteritems(data)
+    elif isinstance(data, list):
+        items = enumerate(data)
+    else:
+        return
+
+    for key, value in items:
+        for item in iter_document_pointers(
+                value, patterns, pointer + '/' + escape_pointer_part(key)):
+            yield item
+
+
+def iter_replicas(value, pointer):
+    """Yield ``(pointer, uri)`` of URIs stored under a document pointer.
+
+    Replica lists are yielded element by element as ``<pointer>/<n>``.
+    """
+    if isinstance(value, list):
+        for index, uri in enumerate(value):
+            if is_uri(uri):
+                yield '{0}/{1}'.format(pointer, index), uri
+    elif is_uri(value):
+        yield pointer, value
+
+
+def iter_uris(data, patterns=None):
+    """Yield ``(pointer, uri)`` for every document URI found in ``data``."""
+    for pointer, value in iter_document_pointers(data, patterns):
+        for item in iter_replicas(value, pointer):
+            yield item
+
+
+def iter_record_pages(ids=None, batch_size=1000):
+    """Yield lists of ``(id, json)`` of stored records page by page.
+
+    Pages are selected by identifier after the previous one, so callers
+    can commit between pages without invalidating an open cursor.
+    Deleted records are included with ``None`` as JSON.
+    """
+    last_id = None
+    while True:
+        query = db.session.query(RecordMetadata.id, RecordMetadata.json)
+        if ids is not None:
+            query = query.filter(RecordMetadata.id.in_(list(ids)))
+        if last_id is not None:
+            query = query.filter(RecordMetadata.id > last_id)
+        rows = query.order_by(RecordMetadata.id).limit(batch_size).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def iter_records(ids=None, batch_size=1000):
+    """Stream ``(id, json)`` of stored records in batches.
+
+    Only the identifier and JSON columns are fetched and rows are not
+    kept in the session, so memory stays bounded by ``batch_size``.
+    """
+    query = db.session.query(RecordMetadata.id, RecordMetadata.json)
+    if ids is not None:
+        query = query.filter(RecordMetadata.id.in_(list(ids)))
+    for id_, data in query.yield_per(batch_size):
+        if data is not None:
+            yield id_, data
+
+
+def uri_scheme(uri):
+    """Return scheme of ``uri`` with ``file`` for plain paths."""
+    if '://' in uri:
+        return uri.split('://', 1)[0].lower()
+    return 'file'
+
+
+def join_uri(root, path):
+    """Build URI of ``path`` inside the storage location ``root``."""
+    if root.endswith('://'):
+        return root + path.lstrip('/')
+    return root.rstrip('/') + '/' + path.lstrip('/')
+
+
+def normalize_uri(uri):
+    """Return canonical form of ``uri`` used to compare references.
+
+    Plain paths and ``osfs://`` URIs become absolute normalized system
+    paths, other URIs lose duplicate and trailing slashes.
+    """
+    scheme = uri_scheme(uri)
+    if scheme in ('file', 'osfs'):
+        path = uri.split('://', 1)[1] if '://' in uri else uri
+        return os.path.normpath(os.path.abspath(path))
+    path = uri.split('://', 1)[1]
+    return scheme + '://' + re.sub('/{2,}', '/', path).rstrip('/')
+
+
+def is_under(uri, base):
+    """Check if ``uri`` is ``base`` or lies inside it.
+
+    Both values are compared on a path boundary, so ``/data2/a`` is not
+    inside ``/data``.
+    """
+    if base.endswith('://'):
+        return uri.startswith(base)
+    base = base.rstrip('/')
+    return uri == base or uri.startswith(base + '/')
+
+
+def as_replicas(value):
+    """Return list of URIs stored under a document pointer."""
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
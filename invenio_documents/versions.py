@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Copy-on-write versions of documents.
+
+Every versioned write stores the content as an immutable object named
+by its hash in the ``DOCUMENTS_VERSIONS_STORE`` location and points the
+document to it.  Identical content is stored only once, so unchanged
+files are shared between versions and documents.  The list of versions
+is kept next to the document URI, so only nested pointers such as
+``/files/0/uri`` can be versioned::
+
+    {
+        "files": [{
+            "uri": "/store/ab/cd/abcd...",
+            "checksum": "sha256:abcd...",
+            "versions": [
+                {"uri": "/data/report.pdf", "checksum": null},
+                {"uri": "/store/ab/cd/abcd...",
+                 "checksum": "sha256:abcd...",
+                 "created": "2016-05-04T12:00:00"}
+            ]
+        }]
+    }
+
+Reading or restoring a previous version only changes a pointer.
+"""
+
+from __future__ import absolute_import, print_function
+
+import hashlib
+import io
+import uuid
+from datetime import datetime
+
+from flask import current_app
+from fs.opener import opener
+from fs.path import dirname
+
+from .api import _setcontents
+from .layout import shard
+from .utils import join_uri
+
+
+class HashingReader(io.RawIOBase):
+    """Compute digest of the content read from a file."""
+
+    def __init__(self, fileobj, algorithm='sha256'):
+        """Initialize reader of ``fileobj``."""
+        super(HashingReader, self).__init__()
+        self._fileobj = fileobj
+        self.algorithm = algorithm
+        self.digest = hashlib.new(algorithm)
+
+    def readable(self):
+        """Return ``True``."""
+        return True
+
+    def readinto(self, buf):
+        """Read chunk into ``buf`` and update the digest."""
+        data = self._fileobj.read(len(buf))
+        self.digest.update(data)
+        buf[:len(data)] = data
+        return len(data)
+
+    @property
+    def checksum(self):
+        """Return ``<algorithm>:<hexdigest>`` of the content read."""
+        return '{0}:{1}'.format(self.algorithm, self.digest.hexdigest())
+
+
+def store_object(source, store=None, **kwargs):
+    """Store content of ``source`` as an immutable object.
+
+    The content is written to a temporary file while it is hashed and
+    then renamed to its final name unless the same object already
+    exists.  Returns ``(uri, checksum)``.
+    """
+    store = store or current_app.config['DOCUMENTS_VERSIONS_STORE']
+    if not store:
+        raise ValueError('DOCUMENTS_VERSIONS_STORE is not configured.')
+    store_fs = opener.opendir(store, writeable=True, create_dir=True)
+    temporary = '.tmp-{0}'.format(uuid.uuid4().hex)
+    reader = HashingReader(source)
+    try:
+        _setcontents(join_uri(store, temporary), reader, **kwargs)
+        hexdigest = reader.digest.hexdigest()
+        name = '{0}/{1}'.format(shard(hexdigest), hexdigest)
+        if store_fs.exists(name):
+            store_fs.remove(temporary)
+        else:
+            store_fs.makedir(dirname(name), recursive=True,
+                             allow_recreate=True)
+            store_fs.rename(temporary, name)
+    except Exception:
+        if store_fs.exists(temporary):
+            store_fs.remove(temporary)
+        raise
+    return join_uri(store, name), reader.checksum
+
+
+def add_version(document, source, **kwargs):
+    """Store new content of ``document`` as its latest version.
+
+    The current file becomes the first version when the document was
+    not versioned before.  Writing the content of the current version
+    again does not create a new one.
+    """
+    if isinstance(document.uri, list):
+        raise ValueError('Replicated documents can not be versioned.')
+    document.versions_pointer  # fail before storing for top-level pointers
+    versions = list(document.versions)
+    if not versions and document.uri is not None:
+        versions.append({'uri': document.uri, 'checksum': document.checksum})
+
+    uri, checksum = store_object(source, **kwargs)
+    if versions and versions[-1]['uri'] == uri:
+        return versions[-1]
+
+    version = {
+        'uri': uri,
+        'checksum': checksum,
+        'created': datetime.utcnow().isoformat(),
+    }
+    versions.append(version)
+    document.versions = versions
+    document.checksum = checksum
+    document.uri = uri
+    return version
@@ -66,6 +66,7 @@ setup_requires = [
 ]
 
 install_requires = [
+    'blinker>=1.4',
     'Flask-BabelEx>=0.9.2',
     'Flask-CLI>=0.2.1',
     'fs>=0.5.3',
@@ -134,6 +135,13 @@ setup(
         'invenio_base.apps': [
             'invenio_documents = invenio_documents:InvenioDocuments',
         ],
+        'invenio_db.models': [
+            'invenio_documents = invenio_documents.models',
+        ],
+        'invenio_documents.drivers': [
+            'pack = invenio_documents.pack:PackDriver',
+            's3 = invenio_documents.drivers:S3Driver',
+        ],
     },
     extras_require=extras_require,
     install_requires=install_requires,
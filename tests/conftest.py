@@ -44,6 +44,7 @@ def app(request):
     app = Flask('testapp')
     app.config.update(
         TESTING=True,
+        DOCUMENTS_URI_POINTERS=['/document', '/other', '*/uri'],
         SQLALCHEMY_DATABASE_URI=os.environ.get(
             'SQLALCHEMY_DATABASE_URI', 'sqlite://'
         ),
@@ -63,3 +64,10 @@ def app(request):
     request.addfinalizer(teardown)
 
     return app
+
+
+@pytest.fixture()
+def uri_index(request):
+    """Connect receivers of the URI index for the duration of a test."""
+    InvenioDocuments.register_signals()
+    request.addfinalizer(InvenioDocuments.unregister_signals)
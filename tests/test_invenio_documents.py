@@ -27,15 +27,27 @@
 
 from __future__ import absolute_import, print_function
 
+import hashlib
+import json
 import os
+import pstats
+import shutil
+import threading
+import time
+import uuid
+from io import BytesIO
 
+import pytest
 from click.testing import CliRunner
 from flask import Flask
 from flask_cli import FlaskCLI, ScriptInfo
+from fs.errors import DestinationExistsError, RemoteConnectionError
+from fs.opener import opener
 from invenio_db import db
 from invenio_records import Record
 
-from invenio_documents import Document, InvenioDocuments
+from invenio_documents import Document, InvenioDocuments, batch, \
+    stat_documents
 from invenio_documents.cli import documents as cmd
 
 
@@ -156,3 +168,1219 @@ def test_cli(app):
         )
         assert result.exit_code == 0
         assert open(hello_strpath).read() == open(bye_strpath).read()
+
+
+def test_garbage_collection(app, tmpdir):
+    """Test detection and removal of unreferenced files."""
+    from invenio_documents.garbage import collect, referenced_uris
+
+    used = tmpdir.join('used.txt')
+    used.write('used')
+    other = tmpdir.join('other.txt')
+    other.write('other')
+    orphan = tmpdir.join('orphan.txt')
+    orphan.write('orphan')
+    nested = tmpdir.mkdir('sub').join('nested.txt')
+    nested.write('nested')
+
+    with app.app_context():
+        Record.create({'homepage': 'https://example.org/record.json',
+                       'title': orphan.strpath,
+                       'files': [{'uri': used.dirname + '//used.txt'},
+                                 {'uri': 'osfs://' + other.strpath}]})
+        db.session.commit()
+
+        root = tmpdir.strpath
+        assert list(collect([root], grace=3600)) == []
+        assert set(collect([root], grace=0)) == set([
+            orphan.strpath, nested.strpath,
+        ])
+        assert os.path.exists(orphan.strpath)
+
+        stale = referenced_uris(prefixes=[root])
+        adopted = tmpdir.join('adopted.txt')
+        adopted.write('adopted')
+        os.utime(adopted.strpath, (0, 0))
+        assert list(collect([root], grace=3600)) == []
+        Record.create({'files': [{'uri': adopted.strpath}]})
+        db.session.commit()
+
+        assert set(collect([root], delete=True, referenced=stale)) == set([
+            orphan.strpath, nested.strpath,
+        ])
+        assert adopted.check()
+        assert used.check()
+        assert other.check()
+        assert not orphan.check()
+        assert not nested.check()
+
+
+def test_uri_index(app, tmpdir, uri_index):
+    """Test reverse lookup of records referencing a URI."""
+    from invenio_documents.models import DocumentURI
+
+    hello = tmpdir.join('hello.txt')
+    hello.write('Hello world!')
+    moved = tmpdir.join('moved.txt')
+    with app.app_context():
+        Record.create({'files': [{'uri': hello.strpath}]})
+        db.session.commit()
+        assert DocumentURI.query.count() == 0
+    app.config['DOCUMENTS_URI_INDEX'] = True
+
+    with app.app_context():
+        record = Record.create({'files': [{'uri': hello.strpath}]})
+        db.session.commit()
+
+        def lookup(uri):
+            return [(e.record_id, e.pointer) for e in DocumentURI.lookup(uri)]
+
+        assert lookup(hello.strpath) == [(record.id, '/files/0/uri')]
+
+        document = Document(record, '/files/0/uri')
+        document.move(moved.strpath)
+        assert lookup(hello.strpath) == []
+        assert lookup(moved.strpath) == [(record.id, '/files/0/uri')]
+
+        copy = tmpdir.join('copy.txt')
+        record = record.patch(document.copy(copy.strpath)).commit()
+        db.session.commit()
+        assert lookup(moved.strpath) == []
+        assert lookup(copy.strpath) == [(record.id, '/files/0/uri')]
+
+        DocumentURI.query.delete()
+        db.session.add(DocumentURI(uri=copy.strpath, record_id=uuid.uuid4(),
+                                   pointer='/document'))
+        db.session.commit()
+        assert len(lookup(copy.strpath)) == 1
+
+        runner = CliRunner()
+        script_info = ScriptInfo(create_app=lambda info: app)
+        result = runner.invoke(cmd, ['reindex', '-b', '1'], obj=script_info)
+        assert result.exit_code == 0
+        assert len(lookup(hello.strpath)) == 1
+
+        result = runner.invoke(cmd, ['lookup', copy.strpath], obj=script_info)
+        assert result.exit_code == 0
+        assert result.output == '{0} /files/0/uri\n'.format(record.id)
+
+        Document(record, '/files/0/uri').remove()
+        assert lookup(copy.strpath) == []
+
+
+def test_batch(app, tmpdir):
+    """Test batched changes of many documents in one record."""
+    first = tmpdir.join('first.txt')
+    first.write('first')
+    second = tmpdir.join('second.txt')
+    second.write('second')
+    moved = tmpdir.join('moved.txt')
+    copy = tmpdir.join('copy.txt')
+
+    with app.app_context():
+        record = Record.create({'files': [
+            {'uri': first.strpath}, {'uri': second.strpath},
+        ]})
+        db.session.commit()
+
+        try:
+            with batch(record) as b:
+                b.copy('/files/1/uri', copy.strpath)
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        assert not copy.check()
+        assert record['files'][1]['uri'] == second.strpath
+
+        with batch(record) as b:
+            b.move('/files/0/uri', moved.strpath)
+            b.copy('/files/1/uri', copy.strpath)
+            assert first.check()
+            assert len(b.patch) == 2
+        assert not first.check()
+        assert moved.read() == 'first'
+        assert copy.read() == 'second'
+        assert b.record['files'][0]['uri'] == moved.strpath
+        assert b.record['files'][1]['uri'] == copy.strpath
+
+        existing = tmpdir.join('existing.txt')
+        existing.write('existing')
+        with pytest.raises(DestinationExistsError):
+            with batch(b.record) as c:
+                c.copy('/files/1/uri', existing.strpath)
+        assert existing.read() == 'existing'
+
+        with pytest.raises(RuntimeError):
+            with batch(b.record) as c:
+                c.copy('/files/1/uri', existing.strpath, overwrite=True)
+                assert existing.read() == 'existing'
+                raise RuntimeError()
+        assert existing.read() == 'existing'
+
+        with batch(b.record) as c:
+            c.copy('/files/1/uri', existing.strpath, overwrite=True)
+        assert existing.read() == 'second'
+        assert c.record['files'][1]['uri'] == existing.strpath
+        assert sorted(f.basename for f in tmpdir.listdir()) == [
+            'copy.txt', 'existing.txt', 'moved.txt', 'second.txt',
+        ]
+
+        db.session.rollback()
+        record = Record.get_record(record.id)
+        assert record['files'][0]['uri'] == moved.strpath
+
+
+def test_throttle(app, tmpdir):
+    """Test bandwidth limited transfers."""
+    from invenio_documents.throttle import TokenBucket
+
+    bucket = TokenBucket(100000)
+    start = time.time()
+    bucket.consume(150000)
+    assert time.time() - start >= 0.4
+
+    hello = tmpdir.join('hello.txt')
+    hello.write('x' * 3000)
+    copy = tmpdir.join('copy.txt')
+    other = tmpdir.join('other.txt')
+
+    app.config.update(
+        DOCUMENTS_BANDWIDTH_LIMITS={'file': 1000},
+        DOCUMENTS_CONCURRENCY_LIMITS={'file': 1},
+    )
+    with app.app_context():
+        record = Record.create({'document': hello.strpath})
+        document = Document(record, '/document')
+
+        start = time.time()
+        document.copy(copy.strpath)
+        assert time.time() - start >= 1.5
+        assert copy.read() == hello.read()
+
+        document.uri = copy.strpath
+        document.move(other.strpath)
+        assert other.read() == hello.read()
+        assert not copy.check()
+
+
+def test_send_document(app, tmpdir):
+    """Test streaming of documents over HTTP."""
+    from invenio_documents.helpers import send_document
+
+    hello = tmpdir.join('hello.txt')
+    hello.write('Hello world!')
+
+    with app.app_context():
+        record = Record.create({'files': [
+            {'uri': hello.strpath, 'checksum': 'md5:abc'},
+        ]})
+        document = Document(record, '/files/0/uri')
+        assert document.checksum == 'md5:abc'
+        top = Document({'document': hello.strpath, 'checksum': 'md5:abc'},
+                       '/document')
+        assert top.checksum is None
+        with pytest.raises(ValueError):
+            top.checksum = 'md5:abc'
+        assert b''.join(document.iter_content(5)) == b'Hello world!'
+        assert b''.join(document.iter_content(5, 6, 11)) == b'world'
+
+    @app.route('/hello')
+    def serve():
+        return send_document(document)
+
+    with app.test_client() as client:
+        res = client.get('/hello')
+        assert res.status_code == 200
+        assert res.data == b'Hello world!'
+        assert res.headers['Content-Length'] == '12'
+        assert res.headers['ETag'] == '"md5:abc"'
+
+        res = client.get('/hello', headers={'If-None-Match': '"md5:abc"'})
+        assert res.status_code == 304
+
+        res = client.get('/hello', headers={'Range': 'bytes=6-10'})
+        assert res.status_code == 206
+        assert res.data == b'world'
+        assert res.headers['Content-Range'] == 'bytes 6-10/12'
+
+        res = client.get('/hello', headers={'Range': 'bytes=20-30'})
+        assert res.status_code == 416
+
+    with app.app_context():
+        document.setcontents(BytesIO(b'Bye!'))
+        assert document.checksum is None
+
+    with app.test_client() as client:
+        res = client.get('/hello', headers={'If-None-Match': '"md5:abc"'})
+        assert res.status_code == 200
+        assert res.data == b'Bye!'
+        assert res.headers['ETag'].startswith('W/"4-')
+
+
+def test_verify(app, tmpdir):
+    """Test fixity verification of stored documents."""
+    from invenio_documents.fixity import compute_checksum
+
+    good = tmpdir.join('good.txt')
+    good.write('good')
+    bad = tmpdir.join('bad.txt')
+    bad.write('bad')
+    missing = tmpdir.join('missing.txt')
+
+    with app.app_context():
+        checksum = compute_checksum(good.strpath)
+        assert checksum == 'md5:755f85c2723bb39381c7379a604160d8'
+        Record.create({'files': [
+            {'uri': good.strpath, 'checksum': checksum},
+            {'uri': bad.strpath, 'checksum': checksum},
+            {'uri': missing.strpath, 'checksum': checksum},
+            {'uri': good.strpath},
+            {'uri': [good.strpath, bad.strpath], 'checksum': checksum},
+        ]})
+        db.session.commit()
+
+    runner = CliRunner()
+    script_info = ScriptInfo(create_app=lambda info: app)
+    result = runner.invoke(
+        cmd, ['verify', '-p', '2', '-a'], obj=script_info
+    )
+    assert result.exit_code == 1
+    lines = sorted(line.split('\t')[0] for line in
+                   result.output.splitlines() if '\t' in line)
+    assert lines == ['mismatch', 'mismatch', 'missing', 'ok', 'ok']
+
+
+def test_derivatives(app, tmpdir):
+    """Test caching and invalidation of document derivatives."""
+    calls = []
+
+    def upper(fp):
+        calls.append(1)
+        return fp.read().upper()
+
+    hello = tmpdir.join('hello.txt')
+    hello.write('Hello world!')
+    moved = tmpdir.join('moved.txt')
+
+    cache = app.extensions['invenio-documents'].derivatives
+    cache.directory = tmpdir.mkdir('cache').strpath
+    cache.register('upper', upper)
+
+    with app.app_context():
+        record = Record.create({'document': hello.strpath})
+        document = Document(record, '/document')
+        assert document.derivative('upper') == b'HELLO WORLD!'
+        assert document.derivative('upper') == b'HELLO WORLD!'
+        assert len(calls) == 1
+
+        document.setcontents(BytesIO(b'Bye bye!'))
+        assert document.derivative('upper') == b'BYE BYE!'
+        assert len(calls) == 2
+
+        document.move(moved.strpath)
+        assert document.derivative('upper') == b'BYE BYE!'
+        assert len(calls) == 3
+
+        moved.write('Changed')
+        assert document.derivative('upper') == b'CHANGED'
+        assert len(calls) == 4
+
+        cache.max_size = 0
+        hello.write('Hello again!')
+        document.uri = hello.strpath
+        assert document.derivative('upper') == b'HELLO AGAIN!'
+        assert cache.size == 0
+
+        cache.max_size, cache.low_water = 40, 0.5
+        for i in range(4):
+            other = tmpdir.join('other{0}.txt'.format(i))
+            other.write('x' * 12)
+            Document(Record.create({'document': other.strpath}),
+                     '/document').derivative('upper')
+        assert cache.size == 12
+
+    Document({'document': hello.strpath}, '/document').uri = moved.strpath
+
+
+def test_content_cache(app, tmpdir):
+    """Test in-memory cache of small documents."""
+    from invenio_documents.cache import ContentCache
+
+    cache = ContentCache(max_entries=2, max_bytes=10, max_item_size=6)
+    cache.set('a', b'aaa')
+    cache.set('b', b'bbb')
+    cache.set('big', b'x' * 7)
+    assert cache.get('big') is None
+    assert cache.get('a') == b'aaa'
+    cache.set('c', b'ccc')
+    assert cache.get('b') is None
+    assert len(cache) == 2
+    cache.set('d', b'dddddd')
+    assert cache.size <= 10
+    assert cache.stats['hits'] == 1
+
+    token = cache.reserve('e')
+    cache.invalidate('e')
+    cache.set('e', b'stale', token=token)
+    cache.release('e', token)
+    assert cache.get('e') is None
+    token = cache.reserve('e')
+    cache.set('e', b'fresh', token=token)
+    cache.release('e', token)
+    assert cache.get('e') == b'fresh'
+
+    hello = tmpdir.join('hello.txt')
+    hello.write('Hello!')
+    app.config['DOCUMENTS_CONTENT_CACHE'] = True
+    ext = app.extensions['invenio-documents']
+    ext.init_content_cache(app)
+
+    with app.app_context():
+        record = Record.create({'document': hello.strpath})
+        document = Document(record, '/document')
+        assert document.open('rb').read() == b'Hello!'
+        hello.write('Hallo!')
+        assert document.open('rb').read() == b'Hello!'
+        assert ext.cache_stats['hits'] == 1
+
+        document.setcontents(BytesIO(b'Bye!'))
+        assert document.open('rb').read() == b'Bye!'
+        assert ext.cache_stats['entries'] == 1
+
+        other = tmpdir.join('other.txt')
+        other.write('Other')
+        target = Document(Record.create({'document': other.strpath}),
+                          '/document')
+        assert target.open('rb').read() == b'Other'
+        document.copy(other.strpath)
+        assert target.open('rb').read() == b'Bye!'
+
+        with batch(record) as documents:
+            documents.remove('/document', force=True)
+        assert ext.cache_stats['entries'] == 1
+
+
+def test_pack(app, tmpdir):
+    """Test packing small documents into a container."""
+    from invenio_documents.garbage import referenced_uris
+    from invenio_documents.pack import PackWriter, pack_documents
+
+    hello = tmpdir.join('hello.txt')
+    hello.write('Hello world!')
+    bye = tmpdir.join('bye.txt')
+    bye.write('Bye bye!')
+    big = tmpdir.join('big.txt')
+    big.write('x' * 100)
+    container = tmpdir.join('documents.pack')
+
+    with app.app_context():
+        record = Record.create({'files': [
+            {'uri': hello.strpath}, {'uri': bye.strpath}, {'uri': big.strpath},
+        ]})
+        documents = [Document(record, '/files/{0}/uri'.format(i))
+                     for i in range(3)]
+        packed = pack_documents(documents, container.strpath, max_size=50)
+        assert len(packed) == 2
+        assert documents[0].uri.startswith('pack://' + container.strpath)
+        assert documents[2].uri == big.strpath
+
+        assert documents[0].open('rb').read() == b'Hello world!'
+        assert documents[1].open('rb').read() == b'Bye bye!'
+        assert b''.join(documents[1].iter_content(3, 4, 7)) == b'bye'
+
+        copy = tmpdir.join('copy.txt')
+        documents[1].copy(copy.strpath)
+        assert copy.read() == 'Bye bye!'
+
+        record.commit()
+        db.session.commit()
+        assert container.strpath in referenced_uris()
+
+    shared = tmpdir.join('shared.pack')
+    writers = [PackWriter(shared.strpath) for _ in range(2)]
+
+    def append(writer, prefix):
+        for i in range(20):
+            writer.add('{0}{1}'.format(prefix, i), BytesIO(b'x' * 1000))
+
+    threads = [threading.Thread(target=append, args=(writer, str(n)))
+               for n, writer in enumerate(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    offsets = sorted(json.loads(line)['offset']
+                     for line in tmpdir.join('shared.pack.index').readlines())
+    assert offsets == list(range(0, 40000, 1000))
+    assert shared.size() == 40000
+
+
+def test_bundle(app, tmpdir):
+    """Test export and import of records with documents."""
+    hello = tmpdir.join('hello.txt')
+    hello.write('Hello world!')
+    bye = tmpdir.join('bye.txt')
+    bye.write('Bye bye!')
+    bundle = tmpdir.join('bundle.tar')
+    destination = tmpdir.mkdir('imported')
+
+    with app.app_context():
+        record = Record.create({'title': 'Bundle', 'files': [
+            {'uri': hello.strpath, 'checksum': 'md5:abc',
+             'versions': [{'uri': bye.strpath, 'checksum': 'md5:def'}]},
+            {'uri': bye.strpath},
+        ]})
+        db.session.commit()
+        record_id = str(record.id)
+
+    runner = CliRunner()
+    script_info = ScriptInfo(create_app=lambda info: app)
+    result = runner.invoke(
+        cmd, ['export', '-i', record_id, '-o', bundle.strpath],
+        obj=script_info
+    )
+    assert result.exit_code == 0
+
+    result = runner.invoke(
+        cmd, ['import', bundle.strpath, destination.strpath, '-w', '2'],
+        obj=script_info
+    )
+    assert result.exit_code == 0
+    old_id, new_id = result.output.split()
+    assert old_id == record_id
+
+    with app.app_context():
+        record = Record.get_record(new_id)
+        assert record['title'] == 'Bundle'
+        uris = [f['uri'] for f in record['files']]
+        assert all(uri.startswith(destination.strpath) for uri in uris)
+        assert [open(uri).read() for uri in uris] == [
+            'Hello world!', 'Bye bye!'
+        ]
+        assert record['files'][0]['checksum'] == 'md5:abc'
+        version = record['files'][0]['versions'][0]['uri']
+        assert version.startswith(destination.strpath)
+        assert open(version).read() == 'Bye bye!'
+
+
+def test_storage_policy(app, tmpdir):
+    """Test retries, timeouts and circuit breaker of storage calls."""
+    from invenio_documents import policy
+    from invenio_documents.errors import CircuitOpenError, \
+        StorageTimeoutError
+
+    app.config['DOCUMENTS_STORAGE_POLICIES'] = {
+        'flaky': {'timeout': 0.2, 'retries': 2, 'backoff': 0.01,
+                  'failure_threshold': 3, 'reset_timeout': 60},
+    }
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RemoteConnectionError()
+        return 'done'
+
+    with app.app_context():
+        assert policy.call(['flaky://a'], flaky, idempotent=True) == 'done'
+        assert len(calls) == 3
+        assert policy.call(
+            ['flaky://a'], lambda: time.sleep(0.3) or 'written'
+        ) == 'written'
+
+        stalled = policy.Watchdog()
+        source = stalled.wrap(BytesIO(b'x' * 10))
+        with pytest.raises(StorageTimeoutError):
+            policy.call(['flaky://a'], lambda: time.sleep(0.5),
+                        watchdog=stalled)
+        with pytest.raises(StorageTimeoutError):
+            source.read(1)
+
+        progressing = policy.Watchdog()
+        source = progressing.wrap(BytesIO(b'x' * 10))
+
+        def transfer():
+            for _ in range(8):
+                source.read(1)
+                time.sleep(0.05)
+            return 'transferred'
+
+        assert policy.call(['flaky://a'], transfer,
+                           watchdog=progressing) == 'transferred'
+
+        del calls[:]
+        with pytest.raises(RemoteConnectionError):
+            policy.call(['flaky://a'], flaky)
+        assert len(calls) == 1
+
+        slow = []
+
+        def sleep():
+            slow.append(1)
+            time.sleep(0.5)
+
+        with pytest.raises(StorageTimeoutError):
+            policy.call(['flaky://a'], sleep, idempotent=True,
+                        read_only=True)
+        assert len(slow) == 1
+
+        with pytest.raises(RemoteConnectionError):
+            policy.call(['flaky://a'], flaky)
+        with pytest.raises(CircuitOpenError):
+            policy.call(['flaky://a'], flaky)
+        assert len(calls) == 2
+
+        assert policy.call(['/tmp/a'], lambda: 'local') == 'local'
+
+    class SlowFile(BytesIO):
+        def read(self, size=-1):
+            time.sleep(0.5)
+            return super(SlowFile, self).read(size)
+
+    hello = tmpdir.join('hello.txt')
+    hello.write('Hello world!')
+    app.config['DOCUMENTS_STORAGE_POLICIES'] = {'file': {'timeout': 0.2}}
+    with app.app_context():
+        document = Document(Record.create({'document': hello.strpath}),
+                            '/document')
+        with pytest.raises(StorageTimeoutError):
+            document.setcontents(SlowFile(b'Bye!'))
+        document.setcontents(BytesIO(b'Bye!'))
+        assert hello.read() == 'Bye!'
+
+
+def test_replication(app, tmpdir, monkeypatch):
+    """Test replicated writes and reads with fallback."""
+    from invenio_documents import replication
+    from invenio_documents.errors import ReplicationError
+
+    tracker = replication.LatencyTracker()
+    monkeypatch.setattr(replication, 'tracker', tracker)
+
+    first = tmpdir.mkdir('first').join('hello.txt')
+    second = tmpdir.mkdir('second').join('hello.txt')
+    moved = [tmpdir.join('first', 'moved.txt').strpath,
+             tmpdir.join('second', 'moved.txt').strpath]
+    app.config['DOCUMENTS_REPLICA_BACKENDS'] = [
+        first.dirname + '/', second.dirname + '/',
+    ]
+
+    with app.app_context():
+        record = Record.create({'document': [first.strpath, second.strpath]})
+        document = Document(record, '/document')
+        assert document.replicas == [first.strpath, second.strpath]
+
+        document.setcontents(BytesIO(b'Hello world!' * 10000))
+        assert first.read() == second.read() == 'Hello world!' * 10000
+
+        tracker.observe(first.strpath, 1)
+        tracker.observe(second.strpath, 2)
+        assert tracker.order(document.replicas) == [
+            first.strpath, second.strpath,
+        ]
+        first.remove()
+        assert document.open('rb').read(12) == b'Hello world!'
+        assert first.dirname + '/' in tracker.failed
+        assert tracker.order(document.replicas) == [
+            second.strpath, first.strpath,
+        ]
+
+        first.write('Hello!')
+        document.move(moved)
+        assert document.replicas == moved
+        document.remove(force=True)
+        assert not any(os.path.exists(path) for path in moved)
+
+        broken = tmpdir.join('missing', 'hello.txt').strpath
+        record = Record.create({'files': [
+            {'uri': [first.strpath, broken], 'checksum': 'md5:abc'},
+        ]})
+        document = Document(record, '/files/0/uri')
+        with pytest.raises(ReplicationError):
+            document.setcontents(BytesIO(b'Bye!'))
+        assert first.read() == 'Bye!'
+        assert document.uri == [first.strpath]
+        assert record['files'][0]['stale_replicas'] == [broken]
+        assert document.checksum is None
+
+        class BrokenFile(BytesIO):
+            def read(self, size=-1):
+                data = super(BrokenFile, self).read(size)
+                if not data:
+                    raise IOError('Connection reset.')
+                return data
+
+        second.write('Hello!')
+        document.uri = [first.strpath, second.strpath]
+        with pytest.raises(IOError):
+            document.setcontents(BrokenFile(b'x' * 100000))
+        assert first.read() == 'Bye!'
+        assert second.read() == 'Hello!'
+        assert first.dirpath().listdir() == [first]
+
+
+def test_layout(app, tmpdir):
+    """Test sharded layout allocation and rebalancing."""
+    from invenio_documents.layout import allocate_uri, shard
+
+    base = tmpdir.mkdir('sharded').strpath
+    assert shard('key', depth=3, width=1).count('/') == 2
+
+    uri = allocate_uri(base, key='key', filename='a.txt')
+    assert uri == '{0}/{1}/key-a.txt'.format(base, shard('key'))
+    assert os.path.isdir(os.path.dirname(uri))
+
+    hello = tmpdir.join('hello.txt')
+    hello.write('Hello world!')
+    sibling = tmpdir.mkdir('sharded2').join('sibling.txt')
+    sibling.write('sibling')
+    kept = tmpdir.join('kept.txt')
+    kept.write('kept')
+    inode = os.stat(hello.strpath).st_ino
+    replicas = [tmpdir.mkdir('first').join('replica.txt').strpath,
+                tmpdir.mkdir('second').join('replica.txt').strpath]
+    with app.app_context():
+        record = Record.create({'document': hello.strpath,
+                                'other': sibling.strpath,
+                                'files': [{'uri': replicas}]})
+        broken = Record.create({'other': kept.strpath,
+                                'document': tmpdir.join('gone').strpath})
+        db.session.commit()
+        record_id, broken_id = str(record.id), str(broken.id)
+
+    runner = CliRunner()
+    script_info = ScriptInfo(create_app=lambda info: app)
+    result = runner.invoke(
+        cmd, ['rebalance', base, '-i', record_id, '-i', broken_id,
+              '-w', '1'],
+        obj=script_info
+    )
+    assert result.exit_code == 1
+    assert broken_id in result.output
+
+    with app.app_context():
+        data = Record.get_record(record_id)
+        assert data['document'].startswith(base + '/')
+        assert data['document'].endswith('-hello.txt')
+        assert data['other'].startswith(base + '/')
+        assert open(data['document']).read() == 'Hello world!'
+        assert os.stat(data['document']).st_ino == inode
+        assert data['files'][0]['uri'] == replicas
+        assert not hello.check()
+        assert not sibling.check()
+
+        assert Record.get_record(broken_id)['other'] == kept.strpath
+        assert kept.check()
+    assert len(list(tmpdir.join('sharded').visit(
+        lambda p: p.isfile()))) == 2
+
+
+def test_delta_setcontents(app, tmpdir):
+    """Test rewriting only changed blocks of a document."""
+    content = os.urandom(4 * 1024)
+    changed = content[:1024] + b'x' * 10 + content[1034:] + b'tail'
+    data = tmpdir.join('data.bin')
+    data.write(content, mode='wb')
+
+    with app.app_context():
+        app.config['DOCUMENTS_DELTA_BLOCK_SIZE'] = 1024
+        record = Record.create({'document': data.strpath})
+        document = Document(record, '/document')
+
+        assert document.setcontents(BytesIO(changed), delta=True) == 1028
+        assert data.read(mode='rb') == changed
+
+        assert document.setcontents(BytesIO(content[:10]), delta=True) == 10
+        assert data.read(mode='rb') == content[:10]
+
+        new = tmpdir.join('new.bin')
+        document.uri = new.strpath
+        assert document.setcontents(BytesIO(content), delta=True) == 4096
+        assert new.read(mode='rb') == content
+
+
+def test_cli_profile(app, tmpdir):
+    """Test per-phase timings of CLI commands."""
+    hello = tmpdir.join('hello.txt')
+    hello.write('Hello world!')
+    copy = tmpdir.join('copy.txt')
+    stats = tmpdir.join('cp.prof')
+
+    with app.app_context():
+        record = Record.create({'document': hello.strpath})
+        db.session.commit()
+        record_id = str(record.id)
+
+    runner = CliRunner()
+    script_info = ScriptInfo(create_app=lambda info: app)
+    result = runner.invoke(
+        cmd, ['--profile', '--profile-output', stats.strpath,
+              'cp', '-i', record_id, '-p', '/document', copy.strpath],
+        obj=script_info
+    )
+    assert result.exit_code == 0
+    assert copy.read() == 'Hello world!'
+    for name in ('record fetch', 'pointer resolution', 'fs open',
+                 'transfer', 'total'):
+        assert name in result.output
+    assert pstats.Stats(stats.strpath).total_calls > 0
+
+
+def test_bulk_remove(app, tmpdir):
+    """Test removing documents of many records."""
+    files = []
+    for i in range(3):
+        data = tmpdir.join('file{0}.txt'.format(i))
+        data.write('content')
+        files.append(data)
+
+    with app.app_context():
+        first = Record.create({'homepage': 'https://example.org/record.json',
+                               'document': files[0].strpath,
+                               'other': files[1].strpath})
+        second = Record.create({'document': files[2].strpath})
+        db.session.commit()
+        first_id, second_id = str(first.id), str(second.id)
+    files[1].remove()
+
+    batch = tmpdir.join('batch.txt')
+    batch.write('{0}\n{1} /document\n{1} /missing\n'.format(
+        first_id, second_id
+    ))
+    runner = CliRunner()
+    script_info = ScriptInfo(create_app=lambda info: app)
+    result = runner.invoke(
+        cmd, ['rm', '--batch', batch.strpath, '--force', '-w', '2'],
+        obj=script_info
+    )
+    assert result.exit_code == 1
+    assert files[1].strpath in result.output
+    assert second_id in result.output
+    assert not files[0].check()
+    assert files[2].check()
+
+    with app.app_context():
+        assert Record.get_record(first_id) == {
+            'homepage': 'https://example.org/record.json',
+            'document': None,
+            'other': None,
+        }
+        assert Record.get_record(second_id)['document'] == files[2].strpath
+
+
+def test_stat(app, tmpdir):
+    """Test cached metadata of documents."""
+    from invenio_documents.models import DocumentStat
+
+    hello = tmpdir.join('hello.txt')
+    hello.write('Hello world!')
+    moved = tmpdir.join('moved.txt')
+    app.config['DOCUMENTS_STAT_CACHE'] = True
+
+    with app.app_context():
+        record = Record.create({'files': [
+            {'uri': hello.strpath, 'checksum': 'md5:1234'},
+        ]})
+        document = Document(record, '/files/0/uri')
+
+        stat = document.stat()
+        assert stat.size == 12
+        assert stat.mimetype == 'text/plain'
+        assert stat.checksum == 'md5:1234'
+        assert stat.mtime is not None
+        assert DocumentStat.get(hello.strpath) is None
+
+        document.setcontents(BytesIO(b'Hello!'))
+        assert DocumentStat.get(hello.strpath).size == 6
+
+        document.move(moved.strpath)
+        assert DocumentStat.get(hello.strpath) is None
+        assert DocumentStat.get(moved.strpath).size == 6
+
+        moved.write('changed behind our back')
+        assert document.stat().size == 6
+        assert document.stat(refresh=True).size == 23
+        assert list(DocumentStat.get_many([moved.strpath])) == [
+            moved.strpath
+        ]
+        assert [stat.size for stat in stat_documents([document])] == [23]
+
+        document.remove(force=True)
+        assert DocumentStat.get(moved.strpath) is None
+
+    other = tmpdir.join('other.txt')
+    other.write('Other')
+    with app.app_context():
+        Record.create({'files': [{'uri': other.strpath,
+                                  'checksum': 'md5:5678'}]})
+        db.session.commit()
+        assert DocumentStat.get(other.strpath) is None
+
+    runner = CliRunner()
+    script_info = ScriptInfo(create_app=lambda info: app)
+    result = runner.invoke(cmd, ['stat'], obj=script_info)
+    assert result.exit_code == 0
+    other.write('Changed')
+    with app.app_context():
+        stat = DocumentStat.get(other.strpath)
+        assert (stat.size, stat.checksum) == (5, 'md5:5678')
+
+    result = runner.invoke(cmd, ['stat', '--refresh'], obj=script_info)
+    assert result.exit_code == 0
+    with app.app_context():
+        assert DocumentStat.get(other.strpath).size == 7
+
+
+def test_versions(app, tmpdir):
+    """Test copy-on-write versions of a document."""
+    hello = tmpdir.join('hello.txt')
+    hello.write('Hello world!')
+    store = tmpdir.mkdir('store')
+
+    with app.app_context():
+        app.config['DOCUMENTS_VERSIONS_STORE'] = store.strpath
+        top = Document(Record.create({'document': hello.strpath}),
+                       '/document')
+        with pytest.raises(ValueError):
+            top.setcontents(BytesIO(b'Bye!'), versioned=True)
+        assert top.uri == hello.strpath
+
+        record = Record.create({'files': [{'uri': hello.strpath}]})
+        document = Document(record, '/files/0/uri')
+
+        document.setcontents(BytesIO(b'Bye!'), versioned=True)
+        assert hello.read() == 'Hello world!'
+        assert document.uri.startswith(store.strpath)
+        assert document.open('rb').read() == b'Bye!'
+        assert document.checksum == 'sha256:' + hashlib.sha256(
+            b'Bye!').hexdigest()
+        assert [v['uri'] for v in document.versions] == [
+            hello.strpath, document.uri
+        ]
+
+        document.setcontents(BytesIO(b'Bye!'), versioned=True)
+        assert len(document.versions) == 2
+
+        document.setcontents(BytesIO(b'Hello world!'), versioned=True)
+        document.setcontents(BytesIO(b'Bye!'), versioned=True)
+        assert len(document.versions) == 4
+        assert document.versions[1]['uri'] == document.uri
+        assert len(list(store.visit(lambda p: p.isfile()))) == 2
+
+        assert document.version(0).open('rb').read() == b'Hello world!'
+        document.checkout(0)
+        assert document.uri == hello.strpath
+        assert document.checksum is None
+
+        shared = document.versions[1]['uri']
+        document.setcontents(BytesIO(b'Changed'))
+        assert len(document.versions) == 5
+        assert hello.read() == 'Hello world!'
+        assert document.version(1).open('rb').read() == b'Bye!'
+        with pytest.raises(ValueError):
+            document.move(tmpdir.join('moved.txt').strpath)
+
+        document.remove(force=True)
+        assert document.uri is None
+        assert document.versions == []
+        assert os.path.exists(shared)
+
+
+def test_locks(app, tmpdir):
+    """Test per-URI locks of document operations."""
+    from invenio_documents.locks import FileLockManager, LocalLockManager
+
+    for manager in (LocalLockManager(),
+                    FileLockManager(tmpdir.mkdir('locks').strpath)):
+        events = []
+
+        def reader():
+            with manager.locked(read=['a']):
+                events.append('read')
+                time.sleep(0.05)
+                events.append('read done')
+
+        def writer():
+            with manager.locked(read=['b'], write=['a']):
+                events.append('write')
+                time.sleep(0.05)
+                events.append('write done')
+
+        threads = [threading.Thread(target=target)
+                   for target in (reader, reader, writer, writer)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+
+        assert events[:2] == ['read', 'read']
+        assert events[4:] == ['write', 'write done', 'write', 'write done']
+        assert manager.stats.as_dict()['write']['acquired'] == 2
+
+    hello = tmpdir.join('hello.txt')
+    hello.write('Hello world!')
+    with app.app_context():
+        ext = app.extensions['invenio-documents']
+        ext.lock_manager = LocalLockManager()
+        document = Document(Record.create({'document': hello.strpath}),
+                            '/document')
+        with document.open('rb') as fp:
+            assert fp.read() == b'Hello world!'
+        document.setcontents(BytesIO(b'Bye!'))
+        assert ext.lock_stats['read']['acquired'] == 1
+        assert ext.lock_stats['write']['acquired'] == 1
+        assert not ext.lock_manager._locks
+
+
+def test_ingest(app, tmpdir):
+    """Test streaming request bodies to documents."""
+    from invenio_documents.errors import ContentTooLargeError
+    from invenio_documents.helpers import receive_document
+
+    hello = tmpdir.join('hello.txt')
+    hello.write('Hello world!')
+
+    with app.app_context():
+        record = Record.create({'document': hello.strpath})
+        db.session.commit()
+        record_id = record.id
+        document = Document(record, '/document')
+
+        assert document.ingest(iter([b'By', b'e', b'!'])) == 4
+        assert hello.read() == 'Bye!'
+
+        with pytest.raises(ContentTooLargeError):
+            document.ingest(iter([b'Too', b' long']), max_size=5)
+        assert hello.read() == 'Bye!'
+        assert tmpdir.listdir() == [hello]
+
+        replica = tmpdir.mkdir('replica').join('hello.txt')
+        replica.write('Bye!')
+        replicated = Document(Record.create({'files': [
+            {'uri': [hello.strpath, replica.strpath]},
+        ]}), '/files/0/uri')
+        with pytest.raises(ContentTooLargeError):
+            replicated.ingest(iter([b'x' * 100000] * 2), max_size=150000)
+        assert hello.read() == replica.read() == 'Bye!'
+        assert replica.dirpath().listdir() == [replica]
+        assert replicated.ingest(iter([b'Hello', b'!'])) == 6
+        assert hello.read() == replica.read() == 'Hello!'
+        hello.write('Bye!')
+
+    @app.route('/upload', methods=['PUT'])
+    def upload():
+        document = Document(Record.get_record(record_id), '/document')
+        return str(receive_document(document, max_size=10))
+
+    with app.test_client() as client:
+        res = client.put('/upload', data=b'Uploaded!')
+        assert res.status_code == 200
+        assert res.data == b'9'
+        assert hello.read() == 'Uploaded!'
+
+        res = client.put('/upload', data=b'Much too long')
+        assert res.status_code == 413
+        assert hello.read() == 'Uploaded!'
+
+
+def test_load_test(app, tmpdir):
+    """Test load generation against a local directory."""
+    from invenio_documents.loadtest import percentile, run
+
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile([1, 2, 3, 4], 99) == 4
+    assert percentile([], 50) is None
+
+    with app.app_context():
+        app.config['DOCUMENTS_STAT_CACHE'] = False
+        stats = run(tmpdir.strpath, workers=2, requests=50, files=2,
+                    file_size=1024, seed=1)
+        assert [item.operation for item in stats] == [
+            'copy', 'move', 'open', 'read', 'setcontents'
+        ]
+        assert sum(item.count for item in stats) == 100
+        assert all(item.errors == 0 for item in stats)
+        assert all(item.p50 <= item.p99 for item in stats if item.count)
+
+    runner = CliRunner()
+    script_info = ScriptInfo(create_app=lambda info: app)
+    result = runner.invoke(
+        cmd, ['loadtest', '-m', 'read=1,open=1', '-w', '2', '-n', '10'],
+        obj=script_info
+    )
+    assert result.exit_code == 0
+    assert 'read' in result.output
+    assert 'move' not in result.output
+
+
+def test_document_refs(app, tmpdir, uri_index):
+    """Test lightweight document references."""
+    from invenio_documents import DocumentRef, iter_document_refs
+
+    hello = tmpdir.join('hello.txt')
+    hello.write('Hello world!')
+
+    assert DocumentRef.__slots__ == ()
+    app.config['DOCUMENTS_URI_INDEX'] = True
+
+    with app.app_context():
+        record = Record.create({'files': [{'uri': hello.strpath},
+                                          {'uri': '/tmp/other.txt'}]})
+        db.session.commit()
+
+        for index in (True, False):
+            app.config['DOCUMENTS_URI_INDEX'] = index
+            refs = list(iter_document_refs(record_ids=[record.id]))
+            assert [(ref.pointer, ref.uri) for ref in refs] == [
+                ('/files/0/uri', hello.strpath),
+                ('/files/1/uri', '/tmp/other.txt'),
+            ]
+            assert all(ref.record_id == record.id for ref in refs)
+
+        document = refs[0].get_document()
+        assert document.open('rb').read() == b'Hello world!'
+        assert document.ref == refs[0]
+
+
+def test_drivers(app, tmpdir):
+    """Test storage drivers registered for a URI scheme."""
+    from invenio_documents.drivers import Driver, get_driver, load_drivers
+    from invenio_documents.pack import PackDriver
+    from invenio_documents.removal import remove_files
+
+    calls = []
+
+    class LocalDriver(Driver):
+        supports_range = True
+        supports_server_copy = True
+        supports_batch_delete = True
+
+        def parse(self, uri):
+            return opener.parse(uri[len('test://'):])
+
+        def open_range(self, uri, start, end=None):
+            calls.append('range')
+            with open(uri[len('test://'):], 'rb') as fp:
+                fp.seek(start)
+                return BytesIO(fp.read(end - start))
+
+        def server_copy(self, src, dst, overwrite=True, **kwargs):
+            calls.append('copy')
+            if not overwrite and os.path.exists(dst[len('test://'):]):
+                raise DestinationExistsError(dst)
+            shutil.copy(src[len('test://'):], dst[len('test://'):])
+
+        def remove_many(self, uris):
+            calls.append('remove')
+            for uri in uris:
+                os.remove(uri[len('test://'):])
+            return [(uri, None) for uri in uris]
+
+    hello = tmpdir.join('hello.txt')
+    hello.write('Hello world!')
+    copy = tmpdir.join('copy.txt')
+
+    with app.app_context():
+        assert isinstance(get_driver('pack:///tmp/a.pack#b'), PackDriver)
+        assert not get_driver('/tmp/hello.txt').supports_range
+
+        ext = app.extensions['invenio-documents']
+        ext.drivers = load_drivers({'test': LocalDriver})
+        document = Document({'document': 'test://' + hello.strpath},
+                            '/document')
+
+        assert b''.join(document.iter_content(start=6, end=11)) == b'world'
+        assert b''.join(document.iter_content()) == b'Hello world!'
+        document.copy('test://' + copy.strpath)
+        assert copy.read() == 'Hello world!'
+        with pytest.raises(DestinationExistsError):
+            document.copy('test://' + copy.strpath, overwrite=False)
+        assert list(remove_files(['test://' + copy.strpath])) == [
+            ('test://' + copy.strpath, None)
+        ]
+        assert not copy.check()
+        assert calls == ['range', 'copy', 'copy', 'remove']
+
+
+class _StubKey(object):
+    """Key of :class:`_StubBucket` answering ranged reads."""
+
+    def __init__(self, data):
+        self.data = data
+        self._fp = None
+
+    def open_read(self, headers=None):
+        start, end = headers['Range'][len('bytes='):].split('-')
+        self._fp = BytesIO(self.data[int(start):int(end) + 1 if end else None])
+
+    def read(self, size=-1):
+        return self._fp.read(size)
+
+    def close(self):
+        self._fp.close()
+
+
+class _StubBucket(object):
+    """In-memory stand-in for a :mod:`boto` bucket."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.keys = {}
+
+    def get_key(self, name):
+        return _StubKey(self.keys[name]) if name in self.keys else None
+
+    def copy_key(self, new_key_name, src_bucket_name, src_key_name):
+        src = self.connection.get_bucket(src_bucket_name)
+        self.keys[new_key_name] = src.keys[src_key_name]
+
+    def delete_keys(self, names):
+        errors = []
+        for name in names:
+            if self.keys.pop(name, None) is None:
+                errors.append(type('Error', (object, ), {
+                    'key': name, 'message': 'NoSuchKey'
+                }))
+        return type('Result', (object, ), {'errors': errors})
+
+
+class _StubConnection(object):
+    """In-memory stand-in for a :mod:`boto` S3 connection."""
+
+    def __init__(self):
+        self.buckets = {}
+
+    def get_bucket(self, name, validate=True):
+        return self.buckets.setdefault(name, _StubBucket(self))
+
+
+def test_s3_driver(app):
+    """Test S3 driver against a stubbed bucket."""
+    from invenio_documents.drivers import S3Driver
+    from invenio_documents.errors import DocumentsError
+
+    connection = _StubConnection()
+    bucket = connection.get_bucket('bucket')
+    bucket.keys['a.txt'] = b'Hello world!'
+    driver = S3Driver(connection=connection)
+    assert driver.split('s3://bucket/dir/a.txt') == ('bucket', 'dir/a.txt')
+
+    with app.app_context():
+        app.extensions['invenio-documents'].drivers = {'s3': driver}
+        document = Document({'files': [{'uri': 's3://bucket/a.txt'}]},
+                            '/files/0/uri')
+        assert b''.join(document.iter_content(start=6, end=11)) == b'world'
+
+        document.copy('s3://bucket/b.txt')
+        assert bucket.keys['b.txt'] == b'Hello world!'
+        bucket.keys['b.txt'] = b'Changed'
+        with pytest.raises(DestinationExistsError):
+            document.copy('s3://bucket/b.txt', overwrite=False)
+        assert bucket.keys['b.txt'] == b'Changed'
+
+        results = driver.remove_many(['s3://bucket/a.txt',
+                                      's3://bucket/missing.txt'])
+        assert results[0] == ('s3://bucket/a.txt', None)
+        assert isinstance(results[1][1], DocumentsError)
+        assert list(bucket.keys) == ['b.txt']